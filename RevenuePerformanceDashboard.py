@@ -1,67 +1,745 @@
-from bokeh.io import show, output_file
-from bokeh.plotting import figure
-from bokeh.models import *
-
+# Only the standard library is imported up here. pandas, requests, 
+# requests_oauthlib and bokeh are imported inside the functions that use 
+# them, so --help, a bad date or a library import don't pay for loading 
+# them, and a fetch-only run (-m ingest) never loads bokeh. The fetch side
+# is loaded up front by load_fetch_dependencies before any thread pool 
+# starts, since threads importing requests at the same time break its 
+# circular submodule imports.
 import datetime
-import requests
-from requests.auth import HTTPBasicAuth
-from requests_oauthlib import OAuth1
-
-import pandas as pd
-
+import email.utils
+
+import codecs
+import collections
+import contextlib
+import contextvars
+import cProfile
+import hashlib
+import importlib
+import io
 import json
 import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import threading
 import time
-import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlparse
+
+# Where each SSP's API lives. benchmark_pipeline.py points these at its 
+# local stand-in server, and the environment variables of the same names 
+# can point a command line run somewhere else (benchmark_startup.py).
+MOPUB_API = os.environ.get('MOPUB_API', 'https://app.mopub.com')
+FYBER_VIDEO_API = os.environ.get('FYBER_VIDEO_API', 'https://api.fyber.com')
+FYBER_DISPLAY_API = os.environ.get('FYBER_DISPLAY_API', 
+                                   'https://console.inner-active.com')
+
+def read_credentials(connector, folder='.'):
+    """
+    Reads a connector's API keys from the <name>.txt files stored locally 
+    (in folder), into a {name: key} dict
+    """
+    credentials = {}
+    for name in connector.credentials:
+        with open(os.path.join(folder, name + '.txt')) as file:
+            credentials[name] = file.read()
+    return credentials
+
+def has_credentials(connector):
+    """True if every key file of the connector exists and has a real key"""
+    try:
+        credentials = read_credentials(connector)
+    except OSError:
+        return False
+    return 'add_key_here' not in credentials.values()
+
+def iso_date(text):
+    """argparse type for the dates, so a bad one fails before any work"""
+    import argparse
+    try:
+        datetime.date.fromisoformat(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "{!r} isn't a date in YYYY-MM-DD format".format(text))
+    return text
+
+def parse_args(argv=None):
+    """Arg Parsing. argv defaults to the command line"""
+    import argparse
+    # The usage line is spelled out because argparse can't build one this 
+    # long out of the blank metavars
+    parser = argparse.ArgumentParser(description='Enter start date and end date' \
+                                     'of the dashboard you want to create',
+                                     usage='%(prog)s -s YYYY-MM-DD -e ' \
+                                     'YYYY-MM-DD [options]')
+
+    parser.add_argument('-s', '--start_date', type=iso_date, metavar='', required=True, 
+                        help="Enter start date in 'YYYY-MM-DD format")
+
+    parser.add_argument('-e', '--end_date', type=iso_date, metavar='', required=True, 
+                        help="Enter end date in 'YYYY-MM-DD format'")
+
+    parser.add_argument('-m', '--mode', type=str, metavar='', 
+                        default='dashboard', 
+                        choices=['dashboard', 'ingest', 'render', 'serve',
+                                 'batch_render', 'drilldown'],
+                        help="dashboard: fetch the APIs and draw the dashboard " \
+                        "(default). ingest: fetch the APIs and save the rows to " \
+                        "the SQLite warehouse. render: draw the dashboard from " \
+                        "the warehouse without calling any APIs. serve: run " \
+                        "the dashboard on a Bokeh server that keeps the data " \
+                        "in memory and fetches new days on a schedule. " \
+                        "batch_render: write a dashboard per app / partner / " \
+                        "country from the Parquet store (see --variants). " \
+                        "drilldown: show which countries / ad units moved " \
+                        "revenue on the end date, from the drilldown store")
+
+    parser.add_argument('--variants', type=str, metavar='', nargs='+',
+                        default=['all', 'app', 'partner', 'country'],
+                        choices=['all', 'app', 'partner', 'country'],
+                        help="Dashboards the batch_render mode writes: all " \
+                        "(the combined one) and / or one per app, partner " \
+                        "or country")
+
+    parser.add_argument('--countries', type=str, metavar='', nargs='*',
+                        default=None,
+                        help="Only write per country dashboards for these " \
+                        "country codes (e.g. US GB DE)")
+
+    parser.add_argument('--dashboard_dir', type=str, metavar='', 
+                        default='dashboards',
+                        help="Folder the batch_render mode writes to")
+
+    parser.add_argument('--render_workers', type=int, metavar='', default=0,
+                        help="Processes the batch_render mode draws " \
+                        "dashboards in (0 = one per CPU)")
+
+    parser.add_argument('--port', type=int, metavar='', default=5006,
+                        help="Port for the serve mode")
+
+    parser.add_argument('--refresh_minutes', type=float, metavar='', default=60,
+                        help="How often the serve mode fetches new days")
+
+    parser.add_argument('--allow_origin', type=str, metavar='', nargs='*',
+                        default=None,
+                        help="host:port names the serve mode may be opened " \
+                        "from besides localhost (e.g. dashboards.example.com:5006)")
+
+    parser.add_argument('--db_path', type=str, metavar='', 
+                        default='revenue_warehouse.db',
+                        help="SQLite warehouse file for the ingest / render modes")
+
+    parser.add_argument('-w', '--workers', type=int, metavar='', default=4,
+                        help="Number of MoPub days to download at the same time " \
+                        "(1 fetches them one after another)")
+
+    parser.add_argument('-t', '--timeout', type=float, metavar='', default=60,
+                        help="Seconds to wait on a single API request")
+
+    parser.add_argument('-r', '--retries', type=int, metavar='', default=3,
+                        help="How many times to retry a failed API request")
+
+    parser.add_argument('--source_workers', type=int, metavar='', default=0,
+                        help="How many partners / accounts to fetch / clean " \
+                        "at the same time (0, the default, runs them all at " \
+                        "once, up to 8, 1 one after another)")
+
+    parser.add_argument('--accounts', type=str, metavar='', default=None,
+                        help="JSON config of the publisher accounts to fetch " \
+                        "(keys and app names of each, see read_accounts), " \
+                        "instead of the .txt key files")
+
+    parser.add_argument('--stream', action='store_true',
+                        help="Parse the Fyber responses as they download " \
+                        "instead of all at once (less memory on long ranges)")
+
+    parser.add_argument('--chunk_days', type=int, metavar='', default=7,
+                        help="Split Fyber date ranges longer than N days into " \
+                        "N day requests, fetched at the same time (0 = one " \
+                        "request for the whole range)")
+
+    parser.add_argument('--checkpoint_dir', type=str, metavar='', 
+                        default='fyber_checkpoints',
+                        help="Folder that finished Fyber chunks are saved to, " \
+                        "so a failed backfill run again with the same dates " \
+                        "picks up where it stopped")
+
+    parser.add_argument('-c', '--cache_dir', type=str, metavar='', default=None,
+                        help="Folder to keep raw per-day API reports in, so " \
+                        "later runs only download days they don't have yet")
+
+    parser.add_argument('--refetch_days', type=int, metavar='', default=3,
+                        help="Always re-download the last N days, since SSP " \
+                        "numbers restate (only used with --cache_dir)")
+
+    parser.add_argument('--cache_max_age', type=int, metavar='', default=None,
+                        help="Delete cached reports for days more than N days ago")
+
+    parser.add_argument('--cache_max_mb', type=float, metavar='', default=None,
+                        help="Delete least recently used cached reports until the " \
+                        "cache is under N megabytes")
+
+    parser.add_argument('--batch_days', type=int, metavar='', default=0,
+                        help="Fetch, clean, save and aggregate the range N " \
+                        "days at a time, so memory stays flat on multi-year " \
+                        "backfills (0 = the whole range at once)")
+
+    parser.add_argument('--fingerprint_path', type=str, metavar='', 
+                        default='revenue_fingerprints.json',
+                        help="Where the content hash of every partner / day " \
+                        "is kept, so only new or restated days get written " \
+                        "to the store / cube again")
+
+    parser.add_argument('--full_refresh', action='store_true',
+                        help="Rewrite every day of the range to the store / " \
+                        "cube, even the ones that haven't changed")
+
+    parser.add_argument('--store_dir', type=str, metavar='', 
+                        default='revenue_store',
+                        help="Folder for the Parquet store of the combined data " \
+                        "(one file per day)")
+
+    parser.add_argument('--cube_path', type=str, metavar='', 
+                        default='revenue_cube.parquet',
+                        help="Where to save the day x partner x unit type x " \
+                        "app totals the charts are drawn from")
+
+    parser.add_argument('--from_cube', action='store_true',
+                        help="Redraw the dashboard for the date range from " \
+                        "the saved cube, without calling any APIs")
+
+    parser.add_argument('--drilldown_dir', type=str, metavar='', 
+                        default='revenue_drilldown',
+                        help="Folder for the day x country x ad unit x " \
+                        "partner totals and each day's top countries / ad " \
+                        "units (one file per day) the drilldown mode reads")
+
+    parser.add_argument('--top_n', type=int, metavar='', default=10,
+                        help="How many countries / ad units the drilldown " \
+                        "keeps per day and charts")
+
+    parser.add_argument('--country', type=str, metavar='', nargs='*', 
+                        default=None,
+                        help="Narrow the drilldown mode down to these countries")
+
+    parser.add_argument('--ad_unit', type=str, metavar='', nargs='*', 
+                        default=None,
+                        help="Narrow the drilldown mode down to these ad units")
+
+    parser.add_argument('--partner', type=str, metavar='', nargs='*', 
+                        default=None,
+                        help="Narrow the drilldown mode down to these partners")
+
+    parser.add_argument('--max_points', type=int, metavar='', default=400,
+                        help="Most bars per chart. Longer ranges are charted " \
+                        "by week, or by month if weeks are still too many")
+
+    parser.add_argument('--no_browser', action='store_true',
+                        help="Just write dashboard.html, without opening it " \
+                        "in a browser (for cron jobs)")
+
+    parser.add_argument('--csv', action='store_true',
+                        help="Also write the combined data, the chart " \
+                        "pivots and the KPIs to csv files " \
+                        "(revenue_performance_data.csv, " \
+                        "revenue-by-day-by-*.csv, kpis-by-day.csv)")
+
+    parser.add_argument('--report', type=str, metavar='', default=None,
+                        help="Write a JSON run report (time, rows, bytes, " \
+                        "retries, memory change and peak memory per stage) " \
+                        "to this file")
+
+    parser.add_argument('--profile', type=str, metavar='', default=None,
+                        help="Run under cProfile and dump the stats to this " \
+                        "file (open with python -m pstats or snakeviz). " \
+                        "Only the main thread is profiled, the partners' " \
+                        "fetch / clean and the downloads run in pool " \
+                        "threads, so see --report for those")
+    return parser.parse_args(argv)
+
+# Run-wide counters, bumped by http_get / iter_json_records, and the stages
+# (see stage) recorded so far. Both are read by write_run_report.
+RUN_STATS = {'requests': 0, 'retries': 0, 'bytes': 0}
+RUN_STAGES = []
+_stats_lock = threading.Lock()
+
+# The counters of the stages open in the current context (see stage). Work
+# handed to a thread pool runs in a copy of the context that handed it out 
+# (see in_stage_context), so a download counts towards the stage that asked
+# for it, not towards another partner's stage that's open at the same time.
+_open_stages = contextvars.ContextVar('open_stages', default=())
+
+def count_stat(name, amount=1):
+    """
+    Adds amount to one of the RUN_STATS counters and to the stages open in
+    the current context (thread safe)
+    """
+    with _stats_lock:
+        RUN_STATS[name] += amount
+        for counts in _open_stages.get():
+            counts[name] += amount
 
-# Global Variables for locally stored api keys
+def in_stage_context(function):
+    """
+    function, wrapped to run in a copy of the caller's context. Hand this 
+    to a thread pool so what the work counts goes to the caller's stages.
+    """
+    context = contextvars.copy_context()
+    def run(*args, **kwargs):
+        # a context can only be entered by one thread at a time
+        return context.copy().run(function, *args, **kwargs)
+    return run
 
-def api_keys():
-    with open('mopub_api_key.txt') as file:
-        mopub_api_key = file.read()
+def memory_in_use_mb():
+    """
+    The process' resident memory right now in MB, or None where there's 
+    no /proc/self/statm (anything but Linux).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+def peak_memory_mb():
+    """
+    The process' peak resident memory so far in MB, or None where the 
+    resource module doesn't exist (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Times the code in the with block and adds a record of it to RUN_STAGES:
+    seconds, the requests / retries / bytes counted while it ran, how 
+    much the process' resident memory grew (or shrank) from start to end 
+    (memory_change_mb), and the process' peak resident memory at its end 
+    (peak_memory_mb) and how much the stage raised it (peak_growth_mb). 
+    The change misses memory a stage used and gave back before it ended;
+    the peak doesn't. The block can set record['rows'].
     
-    with open('mopub_inventory_report_id.txt') as file:
-        mopub_inventory_report_id = file.read()
-        
-    with open('fyber_video_username.txt') as file:
-        fyber_video_username = file.read()
-        
-    with open('fyber_video_password.txt') as file:
-        fyber_video_password = file.read()
+        with stage('clean MoPub') as record:
+            df = mopub_dataframe_cleaner(df)
+            record['rows'] = len(df)
+    
+    The requests / retries / bytes are the stage's own, including work it 
+    hands to a pool through in_stage_context, even with other partners' 
+    stages running at the same time. Memory is the whole process', so the
+    change / peak of stages running at the same time includes each other's.
+    """
+    counts = dict.fromkeys(RUN_STATS, 0)
+    token = _open_stages.set(_open_stages.get() + (counts,))
+    record = {'stage': name, 'rows': None}
+    memory_before = memory_in_use_mb()
+    peak_before = peak_memory_mb()
+    start = time.time()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = repr(e)
+        raise
+    finally:
+        _open_stages.reset(token)
+        record['seconds'] = round(time.time() - start, 3)
+        memory_after = memory_in_use_mb()
+        peak_after = peak_memory_mb()
+        with _stats_lock:
+            record.update(counts)
+            record['memory_change_mb'] = (
+                None if memory_before is None or memory_after is None
+                else round(memory_after - memory_before, 1))
+            record['peak_memory_mb'] = peak_after
+            record['peak_growth_mb'] = (
+                None if peak_before is None or peak_after is None
+                else round(peak_after - peak_before, 1))
+            RUN_STAGES.append(record)
+
+def print_stage_summary():
+    """
+    Prints RUN_STAGES as a table. 'RSS change MB' is the resident memory at
+    the stage's end minus at its start, 'Peak MB' the process' peak at its
+    end, so a stage whose peak is above the row before it had a spike.
+    """
+    if not RUN_STAGES:
+        return
+    print("{:<24}{:>9}{:>10}{:>12}{:>9}{:>15}{:>10}".format(
+        'Stage', 'Seconds', 'Rows', 'KB', 'Retries', 'RSS change MB', 
+        'Peak MB'))
+    for record in RUN_STAGES:
+        print("{:<24}{:>9.2f}{:>10}{:>12,.0f}{:>9}{:>15}{:>10}".format(
+            record['stage'][:23], record['seconds'], 
+            '' if record['rows'] is None else record['rows'], 
+            record['bytes'] / 1024, record['retries'], 
+            '' if record['memory_change_mb'] is None 
+            else '{:+.1f}'.format(record['memory_change_mb']),
+            '' if record.get('peak_memory_mb') is None 
+            else '{:.1f}'.format(record['peak_memory_mb'])))
+
+def write_run_report(report_path, started, arguments):
+    """
+    Writes RUN_STAGES, the RUN_STATS totals and the run's arguments to a 
+    JSON file, so nightly runs can be compared with each other.
+    """
+    import pandas as pd
+    report = {
+        'started': datetime.datetime.fromtimestamp(started).isoformat(),
+        'seconds': round(time.time() - started, 3),
+        'arguments': arguments,
+        'python': sys.version.split()[0],
+        'pandas': pd.__version__,
+        'totals': dict(RUN_STATS, peak_memory_mb=peak_memory_mb()),
+        'stages': RUN_STAGES,
+        'hosts': HOSTS,
+    }
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print("Run report written to {}".format(report_path))
+
+def load_fetch_dependencies():
+    """
+    Imports everything the fetchers / cleaners import lazily, on the 
+    calling thread. Call it before starting threads that fetch: two 
+    threads importing requests at once can each see the other's half 
+    loaded module (ImportError: cannot import name '_basic_auth_str' from
+    partially initialized module 'requests.auth').
+    """
+    import numpy
+    import pandas
+    import requests
+    import requests.adapters
+    import requests.auth
+    import requests_oauthlib
+    return numpy, pandas, requests, requests_oauthlib
+
+def http_session(pool_size=4):
+    """
+    Makes one requests Session that keeps its connections alive, so every
+    download after the first one skips the TLS handshake. The pool is sized
+    to the number of workers so threads don't wait on each other for a
+    connection.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+############################################
+# Request scheduler
+############################################
+
+# Every http_get goes through its host's state here: a token bucket (rate 
+# None = no limit until the host throttles us), a circuit breaker and the 
+# counters print_host_metrics / the run report show.
+HOSTS = {}
+_hosts_lock = threading.Lock()
+
+# Failed tries in a row that open a host's circuit, and how long it stays
+# open (requests to it fail straight away) before it's half open: one try 
+# is let through to see if the host is back, and the others still fail 
+# straight away until it's done. If it fails, the circuit opens again.
+CIRCUIT_FAILURES = 5
+CIRCUIT_SECONDS = 60
+
+# Longest wait between two tries of a request, Retry-After aside
+MAX_BACKOFF = 60
+
+class CircuitOpenError(IOError):
+    """A host failed CIRCUIT_FAILURES times in a row and is being left alone"""
+
+def host_state(host):
+    """The scheduler state of a host, made the first time it's asked for"""
+    with _hosts_lock:
+        if host not in HOSTS:
+            HOSTS[host] = {
+                'rate': None, 'limit': None, 'tokens': 1.0, 
+                'updated': time.time(), 'failures': 0, 'open_until': 0.0,
+                'half_open': False, 'probing': None,
+                'requests': 0, 'retries': 0, 'throttled': 0, 'errors': 0,
+                'waited': 0.0, 'circuit_opens': 0, 'rejected': 0, 'bytes': 0,
+                'first': None, 'last': None}
+        return HOSTS[host]
+
+def set_rate_limit(host, rate_limit):
+    """
+    Caps a host at rate_limit requests a second. If the host already has a
+    lower (throttled) rate, that's kept until it climbs back up.
+    """
+    state = host_state(host)
+    with _hosts_lock:
+        state['limit'] = rate_limit
+        if state['rate'] is None or state['rate'] > rate_limit:
+            state['rate'] = rate_limit
+
+def take_token(host):
+    """
+    Waits for a token from the host's bucket. The bucket fills at 'rate' 
+    tokens a second and holds up to one second's worth, so a burst after a
+    quiet spell is capped too.
+    """
+    state = host_state(host)
+    with _hosts_lock:
+        rate = state['rate']
+        if rate is None:
+            return
+        now = time.time()
+        state['tokens'] = min(max(rate, 1.0), state['tokens'] + 
+                              (now - state['updated']) * rate)
+        state['updated'] = now
+        # Take the token now, even if that puts the bucket in debt, so 
+        # threads waiting on the same host queue up instead of racing
+        state['tokens'] -= 1
+        wait = -state['tokens'] / rate if state['tokens'] < 0 else 0
+        state['waited'] += wait
+    if wait > 0:
+        time.sleep(wait)
+
+def record_result(host, ok, throttled=False, size=0):
+    """
+    Updates the host's counters and circuit after a try. A 429 halves the 
+    host's rate (starting from what it's managed so far if it had no 
+    limit), and every success after that wins back a little of it. A 
+    success closes a half open circuit and any other failure while it's 
+    half open opens it again.
+    """
+    state = host_state(host)
+    with _hosts_lock:
+        now = time.time()
+        state['last'] = now
+        if ok:
+            state['failures'] = 0
+            state['half_open'] = False
+            state['probing'] = None
+            state['bytes'] += size
+            if state['rate'] is not None and (state['limit'] is None or 
+                                              state['rate'] < state['limit']):
+                state['rate'] += 0.1 * state['rate'] ** 0.5
+                if state['limit'] is not None:
+                    state['rate'] = min(state['rate'], state['limit'])
+            return
         
-    with open('fyber_display_publisher_id.txt') as file:
-        fyber_display_publisher_id = file.read()
+        state['errors'] += 1
+        if throttled:
+            state['throttled'] += 1
+            if state['rate'] is None:
+                seconds = max(now - state['first'], 1.0)
+                state['rate'] = state['requests'] / seconds
+            state['rate'] = max(state['rate'] / 2, 0.1)
+        else:
+            state['failures'] += 1
+            if state['half_open'] or state['failures'] >= CIRCUIT_FAILURES:
+                state['open_until'] = now + CIRCUIT_SECONDS
+                state['circuit_opens'] += 1
+                state['failures'] = 0
+                state['half_open'] = True
+                state['probing'] = None
+
+def retry_after(response):
+    """
+    The seconds a 429 / 503's Retry-After header asks for (it can be a 
+    number of seconds or an HTTP date), or None
+    """
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((when - datetime.datetime.now(when.tzinfo)).total_seconds(), 0.0)
+
+def http_get(session, url, timeout=60, retries=3, backoff=1.0, 
+             rate_limit=None, **kwargs):
+    """
+    GETs a url through the request scheduler:
     
-    with open('fyber_display_consumer_key.txt') as file:
-        fyber_display_consumer_key = file.read()
+    - waits for a token from the host's bucket (see take_token), with 
+      rate_limit requests a second as the host's cap if given
+    - retries connection errors, timeouts, 429s and 5xx responses, waiting
+      what Retry-After asks for, or else a random time between 0 and 
+      backoff * 2**try seconds (at most MAX_BACKOFF)
+    - fails straight away with CircuitOpenError while the host's circuit 
+      is open, or half open with another thread's try testing it
+    
+    Other 4xx errors (bad api key, bad report id) won't fix themselves, so
+    they're raised right away. Raises the last error if every try fails.
+    """
+    import requests
+    host = urlparse(url).netloc
+    state = host_state(host)
+    if rate_limit is not None:
+        set_rate_limit(host, rate_limit)
+    
+    for attempt in range(retries+1):
+        with _hosts_lock:
+            if time.time() < state['open_until'] or state['probing']:
+                state['rejected'] += 1
+                raise CircuitOpenError("{} failed {} times in a row, not " \
+                                       "calling it again until {}".format(
+                    host, CIRCUIT_FAILURES, time.strftime(
+                        '%H:%M:%S', time.localtime(state['open_until']))
+                    if not state['probing'] else "a test request is back"))
+            if state['half_open']:
+                # this try is the one let through
+                state['probing'] = threading.get_ident()
         
-    with open('fyber_display_consumer_secret.txt') as file:
-        fyber_display_consumer_secret = file.read()
+        try:
+            take_token(host)
+            with _hosts_lock:
+                state['requests'] += 1
+                if state['first'] is None:
+                    state['first'] = time.time()
+            count_stat('requests')
+            
+            wait = None
+            try:
+                r = session.get(url, timeout=timeout, **kwargs)
+                r.raise_for_status()
+            except (requests.ConnectionError, requests.Timeout, 
+                    requests.HTTPError) as e:
+                response = getattr(e, 'response', None)
+                status = response.status_code if response is not None else None
+                if status is not None and status < 500 and status != 429:
+                    raise
+                record_result(host, ok=False, throttled=(status == 429))
+                if attempt == retries:
+                    raise
+                if status in (429, 503):
+                    wait = retry_after(response)
+                if wait is None:
+                    wait = random.uniform(0, min(backoff * (2 ** attempt), 
+                                                 MAX_BACKOFF))
+                with _hosts_lock:
+                    state['retries'] += 1
+                    state['waited'] += wait
+                count_stat('retries')
+                print("Request failed ({}), retrying in {:.1f} seconds...".format(
+                    e, wait))
+                time.sleep(wait)
+                continue
+            
+            # A streamed body is counted by iter_json_records as it's read
+            size = 0 if kwargs.get('stream') else len(r.content)
+            count_stat('bytes', size)
+            record_result(host, ok=True, size=size)
+            return r
+        finally:
+            # A try that ended without record_result (a 4xx, or some other 
+            # error) lets the next one test the host
+            with _hosts_lock:
+                if state['probing'] == threading.get_ident():
+                    state['probing'] = None
+
+def print_host_metrics():
+    """Prints each host's throughput and throttling, from HOSTS"""
+    if not HOSTS:
+        return
+    print("{:<32}{:>9}{:>8}{:>9}{:>7}{:>9}{:>10}{:>9}".format(
+        'Host', 'Requests', 'Req/s', 'Retries', '429s', 'Wait s', 
+        'Circuit', 'Rate'))
+    for host, state in sorted(HOSTS.items()):
+        seconds = max((state['last'] or 0) - (state['first'] or 0), 1.0)
+        print("{:<32}{:>9}{:>8.1f}{:>9}{:>7}{:>9.1f}{:>10}{:>9}".format(
+            host[:31], state['requests'], state['requests'] / seconds, 
+            state['retries'], state['throttled'], state['waited'], 
+            '{} opened'.format(state['circuit_opens']) 
+            if state['circuit_opens'] else '', 
+            '' if state['rate'] is None else '{:.1f}'.format(state['rate'])))
+
+def iter_json_records(response, key=None, chunk_size=64*1024):
+    """
+    Reads a JSON array of records out of a streamed (stream=True) response 
+    while it downloads and yields the records one at a time, so the whole 
+    body, the decoded string and the whole dict tree are never in memory 
+    together. With `key`, the array is the one under that key of the top 
+    level object (Fyber Video's {"data": [...]}), otherwise the body itself
+    is the array (Fyber Display).
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    if key is None:
+        find_array = re.compile(r'\s*\[').match
+    else:
+        find_array = re.compile(r'"{}"\s*:\s*\['.format(re.escape(key))).search
+    
+    buffer = ''
+    position = None     # None until the array's opening [ shows up
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            count_stat('bytes', len(chunk))
+            buffer += utf8.decode(chunk)
+            if position is None:
+                match = find_array(buffer)
+                if match is None:
+                    continue
+                position = match.end()
+            
+            while True:
+                # Skip the whitespace / commas between records
+                while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                    position += 1
+                if position == len(buffer):
+                    break
+                if buffer[position] == ']':
+                    return
+                try:
+                    record, position = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    # The rest of this record hasn't downloaded yet
+                    break
+                yield record
+            
+            buffer = buffer[position:]
+            position = 0
         
-    return (mopub_api_key, mopub_inventory_report_id, fyber_video_username, 
-            fyber_video_password, fyber_display_publisher_id, 
-            fyber_display_consumer_key, fyber_display_consumer_secret)
-
-# Arg Parsing
-parser = argparse.ArgumentParser(description='Enter start date and end date' \
-                                 'of the dashboard you want to create')
-
-parser.add_argument('-s', '--start_date', type=str, metavar='', required=True, 
-                    help="Enter start date in 'YYYY-MM-DD format")
-
-parser.add_argument('-e', '--end_date', type=str, metavar='', required=True, 
-                    help="Enter end date in 'YYYY-MM-DD format'")
-args = parser.parse_args()
+        raise ValueError("The response ended before its JSON array did")
+    finally:
+        response.close()
 
-def fetch_mopub_report(start_date, end_date, mopub_inventory_report_id, 
-                       mopub_api_key):
+def records_to_dataframe(records, chunk_rows=50000):
     """
-    Selects Data for the specifid time frame from the inventory report id
-    that's pre-made in mopub. MoPub's API is interesting 
-    because it selects dates one at a time, so if you have multiple
-    days, they will be downloaded as individual files. Must be in 
-    valid isoformat, meaning 'YYYY-MM-DD', else it won't work.
+    Builds a DataFrame out of an iterable of records (dicts), chunk_rows 
+    at a time, so only one chunk of dicts is alive next to the finished 
+    columns.
     """
+    import pandas as pd
+    df_container = []
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_rows:
+            df_container.append(pd.DataFrame(chunk))
+            chunk = []
+    if chunk or not df_container:
+        df_container.append(pd.DataFrame(chunk))
+    
+    if len(df_container) == 1:
+        return df_container[0]
+    
+    df = pd.concat(df_container, axis=0, ignore_index=True, sort=False)
+    # A column that's all empty in one chunk comes back as object dtype
+    return df.infer_objects()
+
+def date_strings(start_date, end_date):
+    """Every day from start_date to end_date (inclusive) as 'YYYY-MM-DD'"""
     start_date = datetime.datetime.fromisoformat(start_date)
     end_date = datetime.datetime.fromisoformat(end_date)
 
@@ -74,28 +752,332 @@ def fetch_mopub_report(start_date, end_date, mopub_inventory_report_id,
     date_string_container = []
     for num in range(days+1):
         d_string = d.strftime('%Y-%m-%d')
-        # print(d_string)
         date_string_container.append(d_string)
         d += single_day
     
-    df_container = []
+    return date_string_container
+
+def cache_file(cache_dir, partner, date, extension):
+    """Where the raw report for one partner / day lives in the cache"""
+    return os.path.join(cache_dir, partner, '{}.{}'.format(date, extension))
+
+def read_cache(path, date, refetch_days):
+    """
+    Returns the cached raw report at path, or None if it isn't cached or
+    `date` is still inside the refetch window (SSPs restate the last few 
+    days, so those are always downloaded again). Reading a file bumps its
+    modified time, which is what the size based eviction goes by.
+    """
+    age = (datetime.date.today() - datetime.date.fromisoformat(date)).days
+    if age <= refetch_days or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as file:
+        content = file.read()
+    os.utime(path)
+    return content
+
+def write_cache(path, content):
+    """
+    Saves a raw report to the cache. Writes to a temp file first and moves 
+    it into place, so a crashed run never leaves half a report behind.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'wb') as file:
+        file.write(content)
+    os.replace(temp_path, path)
+
+def write_records(path, records):
+    """
+    Saves records (any iterable of dicts) to path as a JSON array, a 
+    record at a time, so they never all have to be in memory. Like 
+    write_cache, it goes through a temp file, so a crash (or a download 
+    that fails part way) never leaves half a file behind.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write('[')
+            for num, record in enumerate(records):
+                if num:
+                    file.write(',')
+                file.write(json.dumps(record))
+            file.write(']')
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def cached_records(cache_dir, partner, date_list, download, day_of, 
+                   refetch_days=3):
+    """
+    For the JSON APIs (Fyber Video / Fyber Display), which return a whole
+    date range in one call. Calls download(first_day, last_day) once for 
+    the span of days that aren't cached, splits the records it returns by
+    day (using day_of(record)) and caches each day's records, including
+    empty days. Returns the raw records for every day in date_list.
+    """
+    cached = {}
+    for date in date_list:
+        content = read_cache(cache_file(cache_dir, partner, date, 'json'), 
+                             date, refetch_days)
+        if content is not None:
+            cached[date] = json.loads(content.decode('utf-8'))
+    
+    missing = [date for date in date_list if date not in cached]
+    print("Using cached {} data for {} of {} days".format(
+        partner, len(date_list) - len(missing), len(date_list)))
+    
+    if missing:
+        by_day = {date: [] for date in date_strings(missing[0], missing[-1])}
+        for record in download(missing[0], missing[-1]):
+            day = day_of(record)
+            if day in by_day:
+                by_day[day].append(record)
+        
+        for date, records in by_day.items():
+            write_cache(cache_file(cache_dir, partner, date, 'json'), 
+                        json.dumps(records).encode('utf-8'))
+        cached.update(by_day)
+    
+    records = []
+    for date in date_list:
+        records.extend(cached[date])
+    return records
+
+# Checkpoints of runs that never finished are deleted after this many days,
+# so a backfill that's given up on doesn't leave them forever (or have an
+# old run's numbers picked up after the SSP restated them)
+CHECKPOINT_MAX_AGE_DAYS = 7
+
+def checkpoint_folder(checkpoint_dir, partner, start_date, end_date, 
+                      credentials):
+    """
+    Where one run's chunks go: checkpoint_dir/partner/START_END_HASH, the 
+    hash being of the credentials, so only the same range fetched with 
+    the same keys picks them up (and the keys aren't in the name)
+    """
+    key = hashlib.sha256(json.dumps(list(credentials)).encode('utf-8'))
+    return os.path.join(checkpoint_dir, partner, '{}_{}_{}'.format(
+        start_date, end_date, key.hexdigest()[:12]))
+
+def expire_checkpoints(checkpoint_dir, partner, 
+                       max_age=CHECKPOINT_MAX_AGE_DAYS):
+    """Deletes partner's run folders that haven't been written to in max_age days"""
+    partner_dir = os.path.join(checkpoint_dir, partner)
+    if not os.path.isdir(partner_dir):
+        return
+    cutoff = time.time() - max_age * 24 * 60 * 60
+    for name in os.listdir(partner_dir):
+        folder = os.path.join(partner_dir, name)
+        try:
+            if os.path.getmtime(folder) < cutoff:
+                shutil.rmtree(folder, ignore_errors=True)
+        except OSError:
+            # another run deleted it first
+            pass
+
+def chunked_records(partner, start_date, end_date, download, day_of, 
+                    chunk_days=7, workers=4, checkpoint_dir='fyber_checkpoints',
+                    credentials=()):
+    """
+    For long Fyber date ranges. Splits start_date..end_date into chunk_days
+    long pieces (lined up on start_date) and downloads them at the same 
+    time with download(first_day, last_day). Each finished chunk is saved
+    to this run's checkpoint_folder right away, so when a long backfill 
+    dies part way, running the same command again (same range, same 
+    credentials) only downloads the chunks that didn't finish. Records 
+    whose day_of(record) is outside their chunk are dropped, so windows 
+    that overlap at the edges can't double count a day.
+    
+    The records go straight from the download into the checkpoints, and 
+    once every chunk is in they're handed back as an iterator that reads 
+    the checkpoints in order, one chunk at a time. So only one chunk's 
+    records are ever in memory, and with records_to_dataframe only one 
+    chunk_rows batch of them is a list. The checkpoints are deleted once 
+    the last record has been read, not before, so a run that fails 
+    reading them can still pick them up again. If the same run going on at
+    the same time got there first, a missing chunk is downloaded again.
+    """
+    date_list = date_strings(start_date, end_date)
+    chunks = [date_list[num:num+chunk_days] 
+              for num in range(0, len(date_list), chunk_days)]
+    expire_checkpoints(checkpoint_dir, partner)
+    folder = checkpoint_folder(checkpoint_dir, partner, start_date, end_date,
+                               credentials)
+    
+    def chunk_records(chunk):
+        days = set(chunk)
+        return (record for record in download(chunk[0], chunk[-1]) 
+                if day_of(record) in days)
+    
+    def fetch_chunk(chunk):
+        path = os.path.join(folder, '{}_{}.json'.format(chunk[0], chunk[-1]))
+        if os.path.exists(path):
+            print("Using checkpointed {} data from {} to {}".format(
+                partner, chunk[0], chunk[-1]))
+            return path
+        
+        write_records(path, chunk_records(chunk))
+        return path
+    
+    # Every chunk gets to finish (and checkpoint) before an error is raised
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        paths = list(executor.map(in_stage_context(fetch_chunk), chunks))
+    
+    def read_checkpoints():
+        for chunk, path in zip(chunks, paths):
+            try:
+                with open(path, 'rb') as file:
+                    records = json.loads(file.read().decode('utf-8'))
+            except FileNotFoundError:
+                records = list(chunk_records(chunk))
+            yield from records
+            # so it's gone before the next chunk is read
+            del records
+        
+        shutil.rmtree(folder, ignore_errors=True)
+        # Leaves the folders alone if other runs still have checkpoints in
+        # them
+        for parent in (os.path.join(checkpoint_dir, partner), checkpoint_dir):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                pass
+    
+    return read_checkpoints()
+
+def evict_cache(cache_dir, max_age=None, max_mb=None):
+    """
+    Keeps the cache from growing forever. Deletes reports for days more 
+    than max_age days ago, then deletes the least recently used reports 
+    until the whole cache is under max_mb megabytes. Goes through the 
+    whole tree, so named accounts' folders (cache_dir/<account>/<partner>,
+    see run_source) count too.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    
+    files = []
+    for folder, folders, names in os.walk(cache_dir):
+        # .tmp files are reports another run is still writing
+        files += [os.path.join(folder, name) for name in names 
+                  if not name.endswith('.tmp')]
+    
+    removed = 0
+    if max_age is not None:
+        oldest_day = datetime.date.today() - datetime.timedelta(days=max_age)
+        for path in list(files):
+            day = os.path.basename(path)[:10]
+            try:
+                too_old = datetime.date.fromisoformat(day) < oldest_day
+            except ValueError:
+                continue
+            if too_old:
+                os.remove(path)
+                files.remove(path)
+                removed += 1
+    
+    if max_mb is not None:
+        files.sort(key=os.path.getmtime)
+        total_bytes = sum(os.path.getsize(path) for path in files)
+        while files and total_bytes > max_mb * 1024 * 1024:
+            path = files.pop(0)
+            total_bytes -= os.path.getsize(path)
+            os.remove(path)
+            removed += 1
     
-    for date in date_string_container:
+    if removed:
+        print("Removed {} old reports from the cache".format(removed))
+
+def fetch_mopub_report(start_date, end_date, mopub_inventory_report_id, 
+                       mopub_api_key, workers=4, timeout=60, retries=3,
+                       cache_dir=None, refetch_days=3, rate_limit=None):
+    """
+    Selects Data for the specifid time frame from the inventory report id
+    that's pre-made in mopub. MoPub's API is interesting 
+    because it selects dates one at a time, so if you have multiple
+    days, they will be downloaded as individual files. Must be in 
+    valid isoformat, meaning 'YYYY-MM-DD', else it won't work.
+    
+    The days are downloaded by a pool of `workers` threads sharing one
+    keep-alive session, at most rate_limit requests a second. The frames 
+    still come back in date order. With a
+    cache_dir, days that are already cached (and older than refetch_days)
+    are read from disk instead.
+    """
+    import pandas as pd
+    date_string_container = date_strings(start_date, end_date)
+    
+    session = http_session(pool_size=workers)
+    
+    def fetch_day(date):
+        if cache_dir is not None:
+            path = cache_file(cache_dir, 'mopub', date, 'csv')
+            content = read_cache(path, date, refetch_days)
+            if content is not None:
+                return pd.read_csv(io.BytesIO(content))
+        
         print("Fetching MoPub data for {}...".format(date))
-        csv_url = 'https://app.mopub.com/reports/custom/api/download_report?report_key={}&api_key={}&date={}'.format(mopub_inventory_report_id, mopub_api_key, date)
-        df = pd.read_csv(csv_url)
-        df_container.append(df)
+        csv_url = '{}/reports/custom/api/download_report?report_key={}&api_key={}&date={}'.format(MOPUB_API, mopub_inventory_report_id, mopub_api_key, date)
+        r = http_get(session, csv_url, timeout=timeout, retries=retries,
+                     rate_limit=rate_limit)
+        if cache_dir is not None:
+            write_cache(path, r.content)
+        return pd.read_csv(io.BytesIO(r.content))
+    
+    # map() hands results back in the order of date_string_container
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            df_container = list(executor.map(in_stage_context(fetch_day), 
+                                             date_string_container))
+    finally:
+        session.close()
         
     df_concat = pd.concat(df_container, axis=0)
     
     return df_concat
 
-def mopub_dataframe_cleaner(dataframe):
-    """Cleans MoPub data and puts it in a common format"""
+# An app_names key that stands for every app the map doesn't name itself
+OTHER_APPS = '*'
+
+def rename_apps(apps, app_names):
+    """
+    Renames apps (a Series of an SSP's app names) by app_names, the same 
+    way for every SSP: an app app_names doesn't have keeps its name (or 
+    gets the OTHER_APPS one, if it has one) and one it renames to None is
+    left out. Returns the new names and a mask of the rows to keep.
+    """
+    names = app_names or {}
+    apps = apps.astype(object)
+    mapping = {}
+    for app in apps.unique():
+        if app in names:
+            mapping[app] = names[app]
+        elif OTHER_APPS in names:
+            mapping[app] = names[OTHER_APPS]
+        else:
+            mapping[app] = app
+    dropped = [app for app, name in mapping.items() if name is None]
+    return apps.map(mapping), ~apps.isin(dropped)
+
+# What each SSP calls our apps -> the app name the dashboard shows, for the
+# local account (the .txt keys, see Connector.app_names). An account in an 
+# --accounts config can bring its own (see read_accounts).
+MOPUB_APP_NAMES = {"IMVU iOS - #1 3D Avatar Social App": 'IMVU iOS', 
+                   "IMVU Android - #1 3D Avatar Social App": "IMVU Android",
+                   OTHER_APPS: None}
+
+def mopub_dataframe_cleaner(dataframe, app_names=None):
+    """
+    Cleans MoPub data and puts it in a common format. Apps are renamed by 
+    app_names (see rename_apps).
+    """
     print("Cleaning Mopub data...")
     df = dataframe
-    df['App'] = df.App.map({"IMVU iOS - #1 3D Avatar Social App":'IMVU iOS', 
-      "IMVU Android - #1 3D Avatar Social App":"IMVU Android"})
+    df['App'], keep = rename_apps(df['App'], app_names)
       
     df['Total_Code_Served'] = df['Requests']
     df['Partner'] = 'MoPub'
@@ -103,15 +1085,14 @@ def mopub_dataframe_cleaner(dataframe):
     df = df.rename(columns={'App ID':"App_ID", "AdUnit ID":"AdUnit_ID", 
                             'AdUnit Format':"AdUnit_Format"})
 
-    df_pivot = df.pivot_table(index=['Day', 'App', 'AdUnit', 'AdUnit_Format', 
-                                     'Country', 'Partner'],     
-                              values=['Total_Code_Served', 'Requests', 
-                                      'Impressions', 'Clicks', 'Revenue'],                                       
-                              aggfunc='sum')
-
-    df_pivot.to_csv("mopub-pivot.csv")
+    # a groupby rather than pivot_table, which loses the value columns when
+    # every app was left out
+    df_pivot = df[keep].groupby(['Day', 'App', 'AdUnit', 'AdUnit_Format', 
+                                 'Country', 'Partner'])[
+        ['Total_Code_Served', 'Requests', 'Impressions', 'Clicks', 
+         'Revenue']].sum()
 
-    df = pd.read_csv("mopub-pivot.csv")
+    df = df_pivot.reset_index()
 
     df = df.rename(columns={
         'AdUnit_Format':'UnitType'})
@@ -121,23 +1102,79 @@ def mopub_dataframe_cleaner(dataframe):
 
     df = df[['Day', 'App', 'AdUnit', 'UnitType', 'Country', 'Total_Code_Served',
            'Requests', 'Impressions', 'Clicks', 'Revenue', 'Partner']]
-    
-    os.remove("mopub-pivot.csv")
 
     return df
 
 def fetch_fyber_video_report(start_date, end_date, fyber_video_username, 
-        fyber_video_password):
-    """Fectches data from the Fyber video SSP"""
-    print(f"Fetching Fyber Video data from {start_date} to {end_date}...")
-    url = 'https://api.fyber.com/publishers/v2/reporting/publisher-kpis.json?since={}&until={}'.format(start_date, end_date)
-    r = requests.get(url, auth=HTTPBasicAuth(fyber_video_username, fyber_video_password))
-    j = json.loads(r.text)
-    dataframe = pd.DataFrame(j['data'])
+        fyber_video_password, cache_dir=None, refetch_days=3, stream=False,
+        chunk_days=7, workers=4, checkpoint_dir='fyber_checkpoints',
+        timeout=60, retries=3, rate_limit=None):
+    """
+    Fectches data from the Fyber video SSP. With stream, the records are
+    parsed as the response downloads (see iter_json_records). Ranges longer
+    than chunk_days are fetched in checkpointed chunks (see 
+    chunked_records). Requests go through http_get, so they time out, 
+    retry and wait on rate limits like MoPub's.
+    """
+    import pandas as pd
+    from requests.auth import HTTPBasicAuth
+    session = http_session(pool_size=workers)
+    
+    def download(start_date, end_date):
+        print(f"Fetching Fyber Video data from {start_date} to {end_date}...")
+        url = '{}/publishers/v2/reporting/publisher-kpis.json?since={}&until={}'.format(FYBER_VIDEO_API, start_date, end_date)
+        r = http_get(session, url, timeout=timeout, retries=retries, 
+                     rate_limit=rate_limit, stream=stream,
+                     auth=HTTPBasicAuth(fyber_video_username, fyber_video_password))
+        if stream:
+            return iter_json_records(r, key='data')
+        j = json.loads(r.text)
+        return j['data']
+    
+    def day_of(record):
+        return str(record['date'])[:10]
+    
+    def download_range(start_date, end_date):
+        if chunk_days and len(date_strings(start_date, end_date)) > chunk_days:
+            return chunked_records('fyber_video', start_date, end_date, 
+                                   download, day_of, chunk_days=chunk_days, 
+                                   workers=workers, 
+                                   checkpoint_dir=checkpoint_dir,
+                                   credentials=(fyber_video_username, 
+                                                fyber_video_password))
+        return download(start_date, end_date)
+    
+    try:
+        if cache_dir is None:
+            records = download_range(start_date, end_date)
+        else:
+            records = cached_records(cache_dir, 'fyber_video', 
+                                     date_strings(start_date, end_date), 
+                                     download_range, day_of,
+                                     refetch_days=refetch_days)
+        if stream:
+            dataframe = records_to_dataframe(records)
+        else:
+            dataframe = pd.DataFrame(records)
+    finally:
+        session.close()
     return dataframe
 
-def fyber_video_dataframe_cleaner(dataframe):
-    """Cleans/Normalizes data from the Fyber Video SSP"""
+# The IMVU publisher only has the iOS app
+FYBER_DISPLAY_APP_NAMES = {OTHER_APPS: 'IMVU iOS'}
+
+# None = leave the app out
+FYBER_VIDEO_APP_NAMES = {"IMVU iOS Primary Wall": "IMVU iOS", 
+                         "IMVU iOS External Offer Wall": "IMVU iOS", 
+                         "IMVU Google Play": "IMVU Android",
+                         "Blue Bar Bundle ": None, 
+                         "NEXT Featured Offers": None}
+
+def fyber_video_dataframe_cleaner(dataframe, app_names=None):
+    """
+    Cleans/Normalizes data from the Fyber Video SSP. Apps are renamed by
+    app_names (see rename_apps).
+    """
     print("Cleaning Fyber Video...")
     df = dataframe
     df = df.fillna(0)
@@ -145,8 +1182,7 @@ def fyber_video_dataframe_cleaner(dataframe):
     delete_list = ['application_id', 'completions', 'ecpm_eur', 'ecpm_usd', 
                    'fills', 'revenue_eur', 'unique_impressions']
     
-    for entry in delete_list:
-        del df[entry]
+    df = df.drop(columns=delete_list)
         
     df['Ad Type'] = 'video'
     df['Partner'] = 'Fyber_Video'
@@ -159,58 +1195,113 @@ def fyber_video_dataframe_cleaner(dataframe):
                             "impressions":"Impressions", "clicks":"Clicks", 
                             "revenue_usd":"Revenue"})
     
-    df['App'] = df['App'].replace({"IMVU iOS Primary Wall":"IMVU iOS", 
-                                   "IMVU iOS External Offer Wall":"IMVU iOS", 
-                                   "IMVU Google Play":"IMVU Android"}) 
+    df['App'], keep = rename_apps(df['App'], app_names)
 
-    df['Impressions'] = df['Impressions'].apply(lambda x:int(x))
-    df['Requests'] = df['Requests'].apply(lambda x:int(x))
+    df['Impressions'] = df['Impressions'].astype('int64')
+    df['Requests'] = df['Requests'].astype('int64')
 
     df = df[["Day", "App", "AdUnit", "UnitType", "Country", 
              "Total_Code_Served", "Requests", "Impressions", 
              "Clicks", "Revenue", "Partner"]]
 
-    drop_index_list = []
-    for num in list(df.index):
-        if df.loc[num, 'App'] == 'Blue Bar Bundle ' or df.loc[num, 'App'] == 'NEXT Featured Offers':
-            drop_index_list.append(num)
-
-    df = df.drop(drop_index_list, axis=0)
+    df = df[keep]
 
     return df
 
 def fetch_fiber_display_report(start_date, end_date, 
                                fyber_display_publisher_id, 
                                fyber_display_consumer_key, 
-                               fyber_display_consumer_secret):
-    """Fectches data from the Fyber display (inner-active) SSP"""
-    print(f"Fetching Fyber Display data from {start_date} to {end_date}...")
-    start_date = datetime.datetime.fromisoformat(start_date)
-    end_date = datetime.datetime.fromisoformat(end_date)
+                               fyber_display_consumer_secret,
+                               cache_dir=None, refetch_days=3, stream=False,
+                               chunk_days=7, workers=4, 
+                               checkpoint_dir='fyber_checkpoints',
+                               timeout=60, retries=3, rate_limit=None):
+    """
+    Fectches data from the Fyber display (inner-active) SSP. With stream, 
+    the records are parsed as the response downloads. Ranges longer than 
+    chunk_days are fetched in checkpointed chunks.
+    """
+    import pandas as pd
+    from requests_oauthlib import OAuth1
+    session = http_session(pool_size=workers)
+    
+    def download(start_date, end_date):
+        print(f"Fetching Fyber Display data from {start_date} to {end_date}...")
+        start_date = datetime.datetime.fromisoformat(start_date)
+        end_date = datetime.datetime.fromisoformat(end_date)
+        
+        #subtraction is for the time difference - MoPub and Fyber Video are on PST    
+        start_date_unixtime = int(time.mktime(start_date.timetuple()))-14400 
+        end_date_unixtime = datetime.datetime.timestamp(end_date)
+        url = '{}/iamp/services/performance/publisher/{}/{}/{}'.format(FYBER_DISPLAY_API, fyber_display_publisher_id,start_date_unixtime, end_date_unixtime)
+        headers = {"Content-type":"application/json","Accept":"application/json"}
+        auth = OAuth1(fyber_display_consumer_key, fyber_display_consumer_secret) 
+        r = http_get(session, url, timeout=timeout, retries=retries, 
+                     rate_limit=rate_limit, auth=auth, headers=headers, 
+                     stream=stream)
+        if stream:
+            return iter_json_records(r)
+        data = json.loads(r.text)
+        return data
+    
+    def download_whole_days(start_date, end_date):
+        # end_date's timestamp is midnight, so ask for one more day to be 
+        # sure the last day is complete before it goes into the cache / a
+        # chunk (the extra day's records get filtered out by day_of)
+        end_date = datetime.date.fromisoformat(end_date) + datetime.timedelta(days=1)
+        return download(start_date, end_date.isoformat())
+    
+    def day_of(record):
+        return datetime.datetime.utcfromtimestamp(
+            record['date']).strftime('%Y-%m-%d')
     
-    #subtraction is for the time difference - MoPub and Fyber Video are on PST    
-    start_date_unixtime = int(time.mktime(start_date.timetuple()))-14400 
-    end_date_unixtime = datetime.datetime.timestamp(end_date)
-    url = 'https://console.inner-active.com/iamp/services/performance/publisher/{}/{}/{}'.format(fyber_display_publisher_id,start_date_unixtime, end_date_unixtime)
-    headers = {"Content-type":"application/json","Accept":"application/json"}
-    auth = OAuth1(fyber_display_consumer_key, fyber_display_consumer_secret) 
-    r = requests.get(url, auth=auth, headers=headers)
-    data = json.loads(r.text)
-    dataframe = pd.DataFrame(data)
+    def download_range(start_date, end_date, whole_days):
+        if chunk_days and len(date_strings(start_date, end_date)) > chunk_days:
+            return chunked_records('fyber_display', start_date, end_date, 
+                                   download_whole_days, day_of, 
+                                   chunk_days=chunk_days, workers=workers, 
+                                   checkpoint_dir=checkpoint_dir,
+                                   credentials=(fyber_display_publisher_id,
+                                                fyber_display_consumer_key,
+                                                fyber_display_consumer_secret))
+        if whole_days:
+            return download_whole_days(start_date, end_date)
+        return download(start_date, end_date)
+    
+    try:
+        if cache_dir is None:
+            data = download_range(start_date, end_date, whole_days=False)
+        else:
+            data = cached_records(cache_dir, 'fyber_display', 
+                                  date_strings(start_date, end_date), 
+                                  lambda start_date, end_date: download_range(
+                                      start_date, end_date, whole_days=True),
+                                  day_of, refetch_days=refetch_days)
+        if stream:
+            dataframe = records_to_dataframe(data)
+        else:
+            dataframe = pd.DataFrame(data)
+    finally:
+        session.close()
     return dataframe
 
-def fyber_display_dataframe_cleaner(dataframe):
-    """Cleans / Normalizes data from the Fyber display (inner-active) SSP"""
+def fyber_display_dataframe_cleaner(dataframe, app_names=None):
+    """
+    Cleans / Normalizes data from the Fyber display (inner-active) SSP. 
+    The App is the row's contentName, renamed by app_names (see 
+    rename_apps).
+    """
+    import pandas as pd
     print("Cleaning Fyber Display...")
     df = dataframe
     
+    df['App'], keep = rename_apps(df['contentName'], app_names)
+    
     delete_list = ['contentCategories', 'contentId', 'contentName', 'publisherId', 
                    'distributorName', 'ecpm', 'ctr', 'fillRate']
     
-    for entry in delete_list:
-        del df[entry]
+    df = df.drop(columns=delete_list)
 
-    df['App'] = 'IMVU iOS'
     df['Partner'] = 'Fyber'
     df['Total_Code_Served'] = 0
     df['UnitType'] = 'banner'
@@ -219,96 +1310,965 @@ def fyber_display_dataframe_cleaner(dataframe):
                             "clicks":"Clicks", "country":"Country", 'date':'Day', 
                             "revenue":"Revenue", "impressions":"Impressions"})
 
-    df = df[['Day', 'App', 'AdUnit', 'UnitType', 'Country', 'Total_Code_Served',
-           'Requests', 'Impressions', 'Clicks', 'Revenue', 'Partner']]
+    df = df.loc[keep, ['Day', 'App', 'AdUnit', 'UnitType', 'Country', 
+                       'Total_Code_Served', 'Requests', 'Impressions', 
+                       'Clicks', 'Revenue', 'Partner']]
     
-    df['Day'] = pd.to_datetime(df['Day'], unit='s')
-    df['Day'] = df['Day'].apply(lambda x: x.date())
+    df['Day'] = pd.to_datetime(df['Day'], unit='s').dt.date
     
     return df
 
-def bokeh_dashboard_creator(dataframe):
+############################################
+# Partner connectors
+############################################
+
+# One demand source. fetch(start_date, end_date, credentials, **options) 
+# downloads its raw report (options are collect_partner_data's, see 
+# fetch_options in revenue_performance_dashboard) and normalize cleans it 
+# into the FACT_TABLE_DTYPES columns with `partner` in the Partner column 
+# (taking an app_names map as a keyword, for accounts that have their own).
+# Account is filled in by run_source, connectors leave it out.
+# credentials are the key names (the .txt files, without .txt) fetch gets
+# in its credentials dict. max_workers caps how many requests it has open at once and 
+# rate_limit how many it starts a second, as a cap on its host's token 
+# bucket (see http_get, None = no cap). color is its color in the revenue 
+# by partner chart. app_names is the app name map of the local account (the
+# .txt keys), other accounts use the one in their config, if any.
+Connector = collections.namedtuple('Connector', [
+    'name', 'partner', 'credentials', 'fetch', 'normalize', 'max_workers', 
+    'rate_limit', 'color', 'app_names'])
+Connector.__new__.__defaults__ = (None, None, None, None)
+
+# Every registered connector, in registration order
+CONNECTORS = []
+
+def register_connector(connector):
     """
-    This creates the charts / graphs based off the data we pulled from the
-    various APIs and writes the data to csv files for further analysis, if 
-    needed. Bokeh makes JavaScript charts that are interactive and look much 
-    slicker than, say, matplotlib. It's also a lot more complicated
-    and with many more lines of code. This func. makes three charts:
+    Adds a connector to CONNECTORS (replacing one with the same name), so 
+    collect_partner_data fetches it and the charts stack it.
+    """
+    CONNECTORS[:] = [c for c in CONNECTORS if c.name != connector.name]
+    CONNECTORS.append(connector)
+    return connector
+
+def check_schema(connector, dataframe):
+    """
+    Makes sure a connector's normalized frame has every FACT_TABLE_DTYPES 
+    column (raising ValueError if not) and hands back just those columns, 
+    in order and in the FACT_TABLE_DTYPES dtypes.
+    """
+    missing = [c for c in FACT_TABLE_DTYPES if c not in dataframe.columns]
+    if missing:
+        raise ValueError("{} left out the column(s) {}".format(
+            connector.name, ', '.join(missing)))
+    return fact_table_dtypes(dataframe)
+
+def mopub_fetch(start_date, end_date, credentials, workers=4, timeout=60, 
+                retries=3, cache_dir=None, refetch_days=3, rate_limit=None, 
+                **options):
+    return fetch_mopub_report(start_date, end_date, 
+                              credentials['mopub_inventory_report_id'], 
+                              credentials['mopub_api_key'], workers=workers,
+                              timeout=timeout, retries=retries,
+                              cache_dir=cache_dir, refetch_days=refetch_days,
+                              rate_limit=rate_limit)
+
+def fyber_video_fetch(start_date, end_date, credentials, cache_dir=None, 
+                      refetch_days=3, stream=False, chunk_days=7, workers=4, 
+                      checkpoint_dir='fyber_checkpoints', timeout=60, 
+                      retries=3, rate_limit=None, **options):
+    return fetch_fyber_video_report(start_date, end_date, 
+                                    credentials['fyber_video_username'], 
+                                    credentials['fyber_video_password'],
+                                    cache_dir=cache_dir, 
+                                    refetch_days=refetch_days, stream=stream,
+                                    chunk_days=chunk_days, workers=workers,
+                                    checkpoint_dir=checkpoint_dir,
+                                    timeout=timeout, retries=retries,
+                                    rate_limit=rate_limit)
+
+def fyber_display_fetch(start_date, end_date, credentials, cache_dir=None, 
+                        refetch_days=3, stream=False, chunk_days=7, workers=4, 
+                        checkpoint_dir='fyber_checkpoints', timeout=60, 
+                        retries=3, rate_limit=None, **options):
+    return fetch_fiber_display_report(start_date, end_date,
+                                      credentials['fyber_display_publisher_id'],
+                                      credentials['fyber_display_consumer_key'], 
+                                      credentials['fyber_display_consumer_secret'],
+                                      cache_dir=cache_dir, 
+                                      refetch_days=refetch_days, stream=stream,
+                                      chunk_days=chunk_days, workers=workers,
+                                      checkpoint_dir=checkpoint_dir,
+                                      timeout=timeout, retries=retries,
+                                      rate_limit=rate_limit)
+
+register_connector(Connector(
+    name='MoPub', partner='MoPub', 
+    credentials=('mopub_api_key', 'mopub_inventory_report_id'),
+    fetch=mopub_fetch, normalize=mopub_dataframe_cleaner, color='#fdae61',
+    app_names=MOPUB_APP_NAMES))
+
+register_connector(Connector(
+    name='Fyber Video', partner='Fyber_Video', 
+    credentials=('fyber_video_username', 'fyber_video_password'),
+    fetch=fyber_video_fetch, normalize=fyber_video_dataframe_cleaner, 
+    color='#abdda4', app_names=FYBER_VIDEO_APP_NAMES))
+
+register_connector(Connector(
+    name='Fyber Display', partner='Fyber', 
+    credentials=('fyber_display_publisher_id', 'fyber_display_consumer_key',
+                 'fyber_display_consumer_secret'),
+    fetch=fyber_display_fetch, normalize=fyber_display_dataframe_cleaner, 
+    color='#2b83ba', app_names=FYBER_DISPLAY_APP_NAMES))
+
+# One set of API keys for a connector. name tells accounts of the same 
+# connector apart (None for the keys in the .txt files next to the script),
+# credentials is what read_credentials would hand fetch and app_names, if
+# not None, replaces the connector's own app name map in normalize.
+Account = collections.namedtuple('Account', ['connector', 'credentials', 
+                                             'name', 'app_names'])
+Account.__new__.__defaults__ = (None, None)
+
+def account_label(account):
+    """'MoPub', or 'MoPub (acme)' for a named account"""
+    if account.name is None:
+        return account.connector.name
+    return '{} ({})'.format(account.connector.name, account.name)
+
+def partner_account_label(partner):
+    """
+    The account_label of partner's local account. Rows saved before there
+    was an Account column came from the local accounts, so this is theirs.
+    """
+    for connector in CONNECTORS:
+        if connector.partner == partner:
+            return connector.name
+    return partner
+
+def local_accounts():
+    """An account for every registered connector with its .txt key files"""
+    accounts = []
+    for connector in CONNECTORS:
+        if has_credentials(connector):
+            accounts.append(Account(connector, read_credentials(connector), 
+                                    app_names=connector.app_names))
+        else:
+            print("Skipping {}, its API keys aren't set".format(connector.name))
+    return accounts
+
+def read_accounts(config_path):
+    """
+    Loads every account of an accounts config, a JSON file like
     
-    1. Revenue, Impressions by Day by Partner
-    2. Revenue by Day by Ad Unit Type 
-    3. Revenue by App
+        {"accounts": [
+            {"name": "acme", "connector": "MoPub",
+             "credentials": {"mopub_api_key": "...", 
+                             "mopub_inventory_report_id": "..."},
+             "app_names": {"Acme Racing - iOS": "Acme iOS"}},
+            {"name": "acme", "connector": "Fyber Video",
+             "credentials_dir": "keys/acme"}
+        ]}
     
-    The code for each is seperated by number-sign boxes. 
+    credentials_dir is a folder of <name>.txt key files, for keys that 
+    shouldn't sit in the config itself. app_names renames the account's 
+    apps (see rename_apps): apps it doesn't have keep the SSP's name, "*"
+    names all of those and null leaves an app out. Without it, every app 
+    keeps the SSP's name. Raises ValueError for an unknown 
+    connector, a missing key or two accounts with the same name and 
+    connector.
     """
-    ############################################
-    # Revenue, Impressions by Day by Partner
-    ############################################
+    with open(config_path) as f:
+        config = json.load(f)
     
-    output_file("dashboard.html")
+    connectors = {connector.name: connector for connector in CONNECTORS}
+    accounts = []
+    seen = set()
+    for entry in config['accounts']:
+        if entry['connector'] not in connectors:
+            raise ValueError("Unknown connector {!r} in {} (there's {})".format(
+                entry['connector'], config_path, ', '.join(connectors)))
+        connector = connectors[entry['connector']]
+        name = entry.get('name')
+        if (connector.name, name) in seen:
+            raise ValueError("{} has two {} accounts named {!r}".format(
+                config_path, connector.name, name))
+        seen.add((connector.name, name))
+        
+        if 'credentials' in entry:
+            credentials = dict(entry['credentials'])
+        else:
+            credentials = read_credentials(connector, 
+                                           entry.get('credentials_dir', '.'))
+        missing = [key for key in connector.credentials 
+                   if key not in credentials]
+        if missing:
+            raise ValueError("The {} account {!r} is missing {}".format(
+                connector.name, name, ', '.join(missing)))
+        accounts.append(Account(connector, credentials, name, 
+                                entry.get('app_names')))
     
-    df = dataframe
-    df['Day'] = pd.to_datetime(df['Day'])
-    df = df.fillna(0)
+    print("Loaded {} account(s) from {}".format(len(accounts), config_path))
+    return accounts
+
+# The normalized schema every partner's data is cleaned into, with the dtype
+# each column is stored as. 'integer' columns get the smallest int dtype 
+# their values fit (int8 for a column of small click counts, say). Revenue
+# stays float64, since float32 only keeps ~7 digits and would round cents 
+# off the bigger totals. Account is the account_label of the account the row
+# was fetched with, since several accounts can share a Partner.
+FACT_TABLE_DTYPES = {
+    'Day': 'datetime64[ns]', 
+    'App': 'category', 
+    'AdUnit': 'category', 
+    'UnitType': 'category', 
+    'Country': 'category', 
+    'Total_Code_Served': 'integer', 
+    'Requests': 'integer', 
+    'Impressions': 'integer', 
+    'Clicks': 'integer', 
+    'Revenue': 'float64', 
+    'Partner': 'category',
+    'Account': 'category',
+}
+
+def fact_table_dtypes(dataframe):
+    """
+    Puts the combined data into FACT_TABLE_DTYPES. The partners hand back 
+    'Day' as strings or date objects and the counts as a mix of ints, 
+    floats and objects, so everything is made consistent here. Missing 
+    counts become 0. The text columns become categoricals, which store 
+    each distinct value once, so the frame is a fraction of its object 
+    dtype size and groupbys on it are faster. Rows saved without an 
+    Account get partner_account_label's.
+    """
+    import pandas as pd
+    if 'Account' not in dataframe.columns:
+        dataframe = dataframe.assign(Account=dataframe['Partner'].astype(
+            object).map(partner_account_label))
+    df = dataframe[list(FACT_TABLE_DTYPES)].copy()
     
-    impressions_list = df.groupby('Day').Impressions.sum().tolist()
-    revenue_list = df.groupby('Day').Revenue.sum().tolist()
+    for column, dtype in FACT_TABLE_DTYPES.items():
+        if dtype == 'datetime64[ns]':
+            df[column] = pd.to_datetime(df[column])
+        elif dtype == 'integer':
+            counts = pd.to_numeric(df[column]).fillna(0).astype('int64')
+            df[column] = pd.to_numeric(counts, downcast='integer')
+        elif dtype == 'float64':
+            df[column] = pd.to_numeric(df[column]).astype(dtype)
+        else:
+            df[column] = df[column].astype(dtype)
+    
+    df = df.reset_index(drop=True)
+    return df
 
-    df_pivot = df.pivot_table(index=['Day'], columns='Partner', 
-                              values=['Revenue'], aggfunc='sum')
+def concat_facts(df_container):
+    """
+    Joins frames already in FACT_TABLE_DTYPES without losing the dtypes. 
+    pd.concat turns categoricals with different categories into objects, 
+    so each frame's categories are widened to all of them first. A text 
+    column that isn't a categorical (older pyarrow reads them back from 
+    Parquet as objects) is made one.
+    """
+    import pandas as pd
+    df_container = [df.copy() for df in df_container]
+    for column, dtype in FACT_TABLE_DTYPES.items():
+        if dtype != 'category':
+            continue
+        for df in df_container:
+            if df[column].dtype.name != 'category':
+                df[column] = df[column].astype('category')
+        categories = []
+        for df in df_container:
+            categories += [c for c in df[column].cat.categories 
+                           if c not in categories]
+        for df in df_container:
+            df[column] = df[column].cat.set_categories(categories)
+    return pd.concat(df_container, axis=0, ignore_index=True)
+
+def memory_mb(dataframe):
+    """What a frame takes up in memory, strings included, in MB"""
+    return dataframe.memory_usage(deep=True).sum() / 1024 ** 2
+
+def write_fact_store(dataframe, store_dir='revenue_store', accounts=None):
+    """
+    Writes the normalized data to a Parquet file per day 
+    (store_dir/YYYY-MM-DD.parquet). Within a day, only the rows of the 
+    accounts that came back this run (the account labels in accounts, or 
+    else the ones in the data) are replaced, so reruns / restated days 
+    don't double count and a partner that failed this run keeps what was
+    saved for it. Days outside this run's range are left alone. Needs 
+    pyarrow.
+    
+    Returns the written days' rows, the kept ones included, for the 
+    drilldown store and the cube to be built from.
+    """
+    import pandas as pd
+    df = fact_table_dtypes(dataframe)
+    if accounts is None:
+        accounts = df['Account'].unique()
+    os.makedirs(store_dir, exist_ok=True)
+    
+    df_container = []
+    for day, df_day in df.groupby(df['Day'].dt.strftime('%Y-%m-%d')):
+        path = os.path.join(store_dir, '{}.parquet'.format(day))
+        if os.path.exists(path):
+            df_old = fact_table_dtypes(pd.read_parquet(path))
+            df_old = df_old[~df_old['Account'].isin(accounts)]
+            if len(df_old):
+                df_day = concat_facts([df_old, df_day])
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        df_day.to_parquet(temp_path, index=False)
+        os.replace(temp_path, path)
+        df_container.append(df_day)
+    
+    print("Saved {} rows to {}".format(len(df), store_dir))
+    if not df_container:
+        return df
+    return fact_table_dtypes(concat_facts(df_container))
 
-    df_pivot = df_pivot.fillna(0)
+def read_fact_store(store_dir, start_date, end_date):
+    """
+    Reads the days from start_date to end_date back out of the Parquet 
+    store, only opening the files for those days. Returns an empty frame 
+    (with the right columns) if none of them are there.
+    """
+    import pandas as pd
+    df_container = []
+    for date in date_strings(start_date, end_date):
+        path = os.path.join(store_dir, '{}.parquet'.format(date))
+        if os.path.exists(path):
+            # Each day has its own categories and int sizes, and older 
+            # pyarrow hands the categoricals back as objects
+            df_container.append(fact_table_dtypes(pd.read_parquet(path)))
+    
+    if not df_container:
+        return fact_table_dtypes(pd.DataFrame(columns=list(FACT_TABLE_DTYPES)))
+    
+    return fact_table_dtypes(concat_facts(df_container))
 
-    df_pivot['Impressions'] = impressions_list
-    df_pivot['Total_Revenue'] = revenue_list
+def day_fingerprints(dataframe):
+    """
+    A content hash of every day of one account's normalized rows, as 
+    {'YYYY-MM-DD': {'hash', 'rows', 'revenue'}}. The row hashes are added
+    up rather than chained, so the same rows in a different order hash 
+    the same, and any restated number changes it.
+    """
+    import numpy as np
+    import pandas as pd
+    # Account is the same on every row, and leaving it out keeps the hashes
+    # saved before there was an Account column
+    df = dataframe[[c for c in FACT_TABLE_DTYPES if c != 'Account']]
+    row_hashes = pd.util.hash_pandas_object(df, index=False).values
+    days = pd.Series(df['Day'].dt.strftime('%Y-%m-%d').values)
+    groups = days.groupby(days.values, sort=True)
+    codes = groups.ngroup().values
+    
+    # uint64 wraps around on overflow, which is what a hash sum wants
+    hashes = np.zeros(groups.ngroups, dtype='uint64')
+    np.add.at(hashes, codes, row_hashes)
+    rows = np.bincount(codes, minlength=groups.ngroups)
+    revenue = np.bincount(codes, weights=df['Revenue'].fillna(0).values,
+                          minlength=groups.ngroups)
     
-    df_pivot.to_csv("revenue-by-day-by-partner.csv")
-    df2 = pd.read_csv("revenue-by-day-by-partner.csv", skiprows=2)
+    fingerprints = {}
+    for num, day in enumerate(sorted(groups.groups)):
+        fingerprints[day] = {'hash': '{:016x}'.format(int(hashes[num])), 
+                             'rows': int(rows[num]), 
+                             'revenue': float(revenue[num])}
+    return fingerprints
+
+def read_fingerprints(fingerprint_path):
+    """The fingerprints saved by the last run ({} if there aren't any)"""
+    if not os.path.exists(fingerprint_path):
+        return {}
+    with open(fingerprint_path) as f:
+        return json.load(f)
+
+def save_fingerprints(saved, fingerprints, days, fingerprint_path):
+    """
+    Puts this run's fingerprints ({account label: day_fingerprints}, see 
+    collect_partner_data) of days (which were just written downstream) in
+    saved and writes it to fingerprint_path. An account that has no rows 
+    for one of those days (it failed, say) loses its fingerprint for it, 
+    since the day was written without it.
+    """
+    for account in set(saved) | set(fingerprints):
+        account_saved = saved.setdefault(account, {})
+        for day in days:
+            account_saved.pop(day, None)
+            if day in fingerprints.get(account, {}):
+                account_saved[day] = fingerprints[account][day]
     
-    df2['Day'] = pd.to_datetime(df2['Day'])
-    df2 = df2.fillna(0)
-    spectral_switch = ['#2b83ba', '#abdda4', '#fdae61']
+    temp_path = '{}.{}.tmp'.format(fingerprint_path, os.getpid())
+    with open(temp_path, 'w') as f:
+        json.dump(saved, f, indent=1, sort_keys=True)
+    os.replace(temp_path, fingerprint_path)
 
-    df2.columns = ['Day', 'Fyber', 'Fyber_Video', 'MoPub', 
-                   'Impressions', 'Total_Revenue']
+def restated_days(fingerprints, saved):
+    """
+    Compares this run's fingerprints ({account label: day_fingerprints})
+    with the saved ones and returns the days whose rows changed, sorted, 
+    and prints the restated ones (days seen before whose numbers changed)
+    with their revenue change. 
+    
+    Only accounts that came back this run are compared, so an account 
+    that failed to fetch doesn't make every day look restated, even when
+    other accounts of the same partner worked. An account in this run 
+    that had rows for a day before but has none now restated it to 0.
+    """
+    run_days = set(day for days in fingerprints.values() for day in days)
+    new_days = set()
+    restated = []
+    for account, days in fingerprints.items():
+        account_saved = saved.get(account, {})
+        for day in sorted(run_days):
+            before = account_saved.get(day)
+            after = days.get(day)
+            if before is None and after is not None:
+                new_days.add(day)
+            elif before is not None and (after is None or 
+                                         before['hash'] != after['hash']):
+                restated.append((day, account, before['revenue'], 
+                                 after['revenue'] if after else 0.0))
+    
+    for day, account, before, after in sorted(restated):
+        print("Restated: {} {:<14} revenue {:,.2f} -> {:,.2f} ({:+,.2f})" \
+              .format(day, account, before, after, after - before))
+    
+    restated_days = set(day for day, account, before, after in restated)
+    changed = new_days | restated_days
+    print("{} new / {} restated / {} unchanged day(s)".format(
+        len(new_days - restated_days), len(restated_days), 
+        len(run_days - changed)))
+    return sorted(changed)
+
+# The rollup cube the charts are drawn from: the detail rows summed up to
+# one row per Day x Partner x UnitType x App
+CUBE_DIMENSIONS = ['Day', 'Partner', 'UnitType', 'App']
+CUBE_MEASURES = ['Total_Code_Served', 'Requests', 'Impressions', 'Clicks', 
+                 'Revenue']
+
+# What a missing App / UnitType / Country... is called in the cube, e.g. a
+# MoPub ad format the cleaner has no unit type for
+MISSING_DIMENSION = 'unknown'
+
+def fill_missing_dimensions(dataframe, columns):
+    """
+    Replaces missing values in the (text or category) columns with 
+    MISSING_DIMENSION, in place, so grouping by them keeps those rows
+    """
+    for column in columns:
+        values = dataframe[column]
+        if not values.isnull().any():
+            continue
+        if values.dtype.name == 'category':
+            if MISSING_DIMENSION not in values.cat.categories:
+                values = values.cat.add_categories([MISSING_DIMENSION])
+        dataframe[column] = values.fillna(MISSING_DIMENSION)
+
+def build_rollup_cube(dataframe, dimensions=CUBE_DIMENSIONS):
+    """
+    Sums the detail rows up to Day x Partner x UnitType x App in one 
+    groupby. Country / AdUnit are summed away, so the cube is a small 
+    fraction of the detail rows and every chart / csv export is a cheap 
+    pivot of it. Missing measures become 0 and missing dimensions 
+    MISSING_DIMENSION, so no rows are dropped. Extra dimensions (e.g. 
+    CUBE_DIMENSIONS + ['Country']) keep those columns too.
+    """
+    import pandas as pd
+    dimensions = list(dimensions)
+    df = dataframe[dimensions + CUBE_MEASURES].copy()
+    df['Day'] = pd.to_datetime(df['Day'])
+    fill_missing_dimensions(df, dimensions[1:])
+    df[CUBE_MEASURES] = df[CUBE_MEASURES].fillna(0)
+    # The detail counts can be as small as int8, so sum them as int64
+    for column in CUBE_MEASURES:
+        if df[column].dtype.kind in 'iu':
+            df[column] = df[column].astype('int64')
+    
+    # observed=True: only the combinations in the data, not every mix of 
+    # the categories
+    cube = df.groupby(dimensions, observed=True)[CUBE_MEASURES].sum()
+    cube = cube.reset_index()
+    for column in dimensions[1:]:
+        cube[column] = cube[column].astype(object)
+    return cube
+
+def replace_slices(old_cube, cube):
+    """
+    old_cube's rows minus the Day x Partner slices cube has, followed by 
+    cube's. A partner missing from cube (e.g. it failed this run) keeps 
+    its old rows for those days.
+    """
+    import pandas as pd
+    slices = pd.MultiIndex.from_frame(cube[['Day', 'Partner']])
+    replaced = pd.MultiIndex.from_frame(old_cube[['Day', 'Partner']]).isin(slices)
+    return pd.concat([old_cube[~replaced], cube], axis=0, sort=False)
 
-    df2['Day'] = pd.to_datetime(df2['Day'])
+def write_cube(cube, cube_path='revenue_cube.parquet', 
+               dimensions=CUBE_DIMENSIONS):
+    """
+    Saves the cube to a Parquet file. The Day x Partner slices already in
+    the file are replaced by this run's numbers (see replace_slices) and 
+    the rest are kept, so the file builds up history across runs. The 
+    rows are kept sorted by dimensions.
+    """
+    import pandas as pd
+    if os.path.exists(cube_path):
+        cube = replace_slices(pd.read_parquet(cube_path), cube)
+        cube = cube.sort_values(dimensions).reset_index(drop=True)
+    
+    temp_path = '{}.{}.tmp'.format(cube_path, os.getpid())
+    cube.to_parquet(temp_path, index=False)
+    os.replace(temp_path, cube_path)
+
+def read_cube(cube_path, start_date, end_date):
+    """Reads the start_date..end_date part of a saved cube"""
+    import pandas as pd
+    cube = pd.read_parquet(cube_path)
+    in_range = ((cube['Day'] >= pd.Timestamp(start_date)) & 
+                (cube['Day'] <= pd.Timestamp(end_date)))
+    return cube[in_range].reset_index(drop=True)
+
+# The drilldown store: the detail rows summed to one row per 
+# Day x Country x AdUnit x Partner, sorted in that order, next to a table of
+# each day's top countries / ad units (see write_drilldown). Like the fact 
+# store, there's a file of each per day.
+DRILLDOWN_DIMENSIONS = ['Day', 'Country', 'AdUnit', 'Partner']
+TOP_DIMENSIONS = ['Day', 'Dimension', 'Rank']
+
+def drilldown_files(drilldown_dir, day):
+    """
+    The files of one day ('YYYY-MM-DD') of the drilldown store: 
+    drilldown_dir/YYYY-MM-DD.parquet and its top slices' 
+    drilldown_dir/top/YYYY-MM-DD.parquet
+    """
+    return (os.path.join(drilldown_dir, '{}.parquet'.format(day)), 
+            os.path.join(drilldown_dir, 'top', '{}.parquet'.format(day)))
 
-    source = ColumnDataSource(df2)
+def top_slices(drilldown, top_n=10):
+    """
+    The top_n countries and ad units by revenue for every day in 
+    drilldown, ranked from 1, in one frame with Day, Dimension ('Country'
+    or 'AdUnit'), Rank, Name, Revenue and Impressions columns
+    """
+    import pandas as pd
+    tops = []
+    for dimension in ['Country', 'AdUnit']:
+        df = drilldown.groupby(['Day', dimension])[['Revenue', 
+                                                    'Impressions']].sum()
+        df = df.reset_index().sort_values(['Day', 'Revenue'], 
+                                          ascending=[True, False])
+        df = df.groupby('Day').head(top_n)
+        df['Rank'] = df.groupby('Day').cumcount() + 1
+        df['Dimension'] = dimension
+        df = df.rename(columns={dimension: 'Name'})
+        tops.append(df[['Day', 'Dimension', 'Rank', 'Name', 'Revenue', 
+                        'Impressions']])
+    return pd.concat(tops, axis=0, ignore_index=True)
+
+def write_drilldown(dataframe, drilldown_dir='revenue_drilldown', top_n=10):
+    """
+    Sums the detail rows to Day x Country x AdUnit x Partner and saves 
+    each day's, sorted, and its top_n countries / ad units (see 
+    top_slices) to the day's drilldown_files. Like the cube, this run's 
+    Day x Partner slices replace what was saved for them (see 
+    replace_slices) and only this run's days' files are touched, so a 
+    batch of a long backfill costs the same however much history there 
+    is. Runs at ingest, so the drilldown never has to touch the detail 
+    rows again.
+    """
+    import pandas as pd
+    drilldown = build_rollup_cube(dataframe, DRILLDOWN_DIMENSIONS)
+    os.makedirs(os.path.join(drilldown_dir, 'top'), exist_ok=True)
+    
+    for day, df_day in drilldown.groupby(drilldown['Day'].dt.strftime('%Y-%m-%d')):
+        paths = drilldown_files(drilldown_dir, day)
+        if os.path.exists(paths[0]):
+            df_day = replace_slices(pd.read_parquet(paths[0]), df_day)
+        df_day = df_day.sort_values(DRILLDOWN_DIMENSIONS)
+        for path, df in zip(paths, [df_day, top_slices(df_day, top_n)]):
+            temp_path = '{}.{}.tmp'.format(path, os.getpid())
+            df.to_parquet(temp_path, index=False)
+            os.replace(temp_path, path)
+    return drilldown
+
+def read_drilldown(drilldown_dir, start_date, end_date):
+    """
+    Reads the start_date..end_date days of the drilldown store, indexed 
+    (and sorted) by Day, Country, AdUnit, Partner for drilldown_query, 
+    plus the matching top countries / ad units. Both are empty (with the 
+    right columns) if none of the days are there.
+    """
+    import pandas as pd
+    drilldowns, tops = [], []
+    for day in date_strings(start_date, end_date):
+        path, top_file = drilldown_files(drilldown_dir, day)
+        if os.path.exists(path):
+            drilldowns.append(pd.read_parquet(path))
+        if os.path.exists(top_file):
+            tops.append(pd.read_parquet(top_file))
+    if not drilldowns:
+        drilldowns = [pd.DataFrame(columns=DRILLDOWN_DIMENSIONS + CUBE_MEASURES)]
+    if not tops:
+        tops = [pd.DataFrame(columns=TOP_DIMENSIONS + ['Name', 'Revenue', 
+                                                      'Impressions'])]
+    
+    drilldown = pd.concat(drilldowns, axis=0, ignore_index=True, sort=False)
+    drilldown['Day'] = pd.to_datetime(drilldown['Day'])
+    drilldown = drilldown.set_index(DRILLDOWN_DIMENSIONS).sort_index()
+    top = pd.concat(tops, axis=0, ignore_index=True, sort=False)
+    top['Day'] = pd.to_datetime(top['Day'])
+    return drilldown, top
+
+def drilldown_query(drilldown, start_date, end_date, by='Country', 
+                    country=None, ad_unit=None, partner=None):
+    """
+    Totals of the days start_date..end_date of an indexed drilldown (see 
+    read_drilldown) by one or more of Day / Country / AdUnit / Partner, 
+    biggest revenue first. country, ad_unit and partner narrow it down to
+    one name or a list of them. The slice is a lookup on the sorted index,
+    so only the matching rows are ever touched.
+    
+        drilldown_query(drilldown, '2019-08-01', '2019-08-01', by='AdUnit',
+                        country='US', partner=['MoPub', 'Fyber'])
+    """
+    import pandas as pd
+    def level(names):
+        if names is None:
+            return slice(None)
+        return [names] if isinstance(names, str) else list(names)
+    
+    index = pd.IndexSlice[pd.Timestamp(start_date):pd.Timestamp(end_date), 
+                          level(country), level(ad_unit), level(partner)]
+    try:
+        rows = drilldown.loc[index, :]
+    except KeyError:
+        # one of the names isn't in the store at all
+        rows = drilldown.iloc[:0]
+    
+    totals = rows.groupby(level=by)[CUBE_MEASURES].sum()
+    return totals.sort_values('Revenue', ascending=False)
 
-    colors=spectral_switch
+def drilldown_changes(drilldown, day, by='Country', top_n=10, **filters):
+    """
+    Revenue by `by` on day next to the day before, with the top_n biggest
+    changes (up or down) first. Answers "which countries drove 
+    yesterday's drop?". filters are drilldown_query's.
+    """
+    import pandas as pd
+    day = pd.Timestamp(day)
+    before = day - pd.Timedelta(days=1)
+    changes = pd.DataFrame({
+        'Revenue': drilldown_query(drilldown, day, day, by=by, 
+                                   **filters)['Revenue'],
+        'Previous_Revenue': drilldown_query(drilldown, before, before, by=by,
+                                            **filters)['Revenue'],
+    }).fillna(0)
+    changes['Change'] = changes['Revenue'] - changes['Previous_Revenue']
+    changes.index.name = by
+    order = changes['Change'].abs().sort_values(ascending=False).index
+    return changes.loc[order].head(top_n)
+
+def warehouse_connection(db_path='revenue_warehouse.db'):
+    """
+    Opens the SQLite warehouse, making the revenue table (same columns as
+    FACT_TABLE_DTYPES, Day stored as 'YYYY-MM-DD') and its 
+    (Day, Partner, Account) index the first time. A warehouse made before 
+    there was an Account column gets one, filled in with 
+    partner_account_label.
+    """
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS revenue (
+            Day TEXT NOT NULL,
+            App TEXT,
+            AdUnit TEXT,
+            UnitType TEXT,
+            Country TEXT,
+            Total_Code_Served INTEGER,
+            Requests INTEGER,
+            Impressions INTEGER,
+            Clicks INTEGER,
+            Revenue REAL,
+            Partner TEXT NOT NULL,
+            Account TEXT
+        )""")
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(revenue)")]
+    if 'Account' not in columns:
+        with conn:
+            conn.execute("ALTER TABLE revenue ADD COLUMN Account TEXT")
+            partners = [row[0] for row in 
+                        conn.execute("SELECT DISTINCT Partner FROM revenue")]
+            conn.executemany("UPDATE revenue SET Account = ? WHERE Partner = ?",
+                             [(partner_account_label(partner), partner) 
+                              for partner in partners])
+            conn.execute("DROP INDEX IF EXISTS revenue_day_partner_app")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS revenue_day_partner_account 
+        ON revenue (Day, Partner, Account)""")
+    return conn
+
+def ingest_to_warehouse(dataframe, db_path='revenue_warehouse.db', 
+                        accounts=None):
+    """
+    Upserts the normalized rows into the SQLite warehouse. Every 
+    (Day, Partner, Account) slice of the days in the data and of accounts 
+    (the labels of the accounts that came back, all the ones in the data 
+    by default) replaces whatever the warehouse had for it, so restated 
+    days are overwritten rather than double counted, and an account that
+    failed keeps its rows even when another account of its Partner came 
+    back. The deletes and the bulk insert run in one transaction, so a 
+    failed ingest leaves the warehouse as it was.
+    """
+    df = fact_table_dtypes(dataframe)
+    df['Day'] = df['Day'].dt.strftime('%Y-%m-%d')
+    
+    columns = list(FACT_TABLE_DTYPES)
+    values = []
+    for column in columns:
+        if FACT_TABLE_DTYPES[column] in ('integer', 'float64'):
+            values.append(df[column].tolist())
+        else:
+            # sqlite wants None for missing text, not NaN
+            values.append(df[column].astype(object).where(
+                df[column].notnull(), None).tolist())
+    rows = list(zip(*values))
+    
+    partners = df[['Account', 'Partner']].drop_duplicates('Account').astype(str)
+    partners = dict(zip(partners['Account'], partners['Partner']))
+    if accounts is None:
+        accounts = list(partners)
+    slices = [(day, partners[account], account) 
+              for day in sorted(set(df['Day'])) 
+              for account in accounts if account in partners]
+    
+    conn = warehouse_connection(db_path)
+    try:
+        with conn:
+            conn.executemany("DELETE FROM revenue WHERE Day = ? AND " \
+                             "Partner = ? AND Account = ?", slices)
+            conn.executemany("INSERT INTO revenue ({}) VALUES ({})".format(
+                ', '.join(columns), ', '.join('?' * len(columns))), rows)
+    finally:
+        conn.close()
+    
+    print("Saved {} rows ({} account days) to {}".format(
+        len(rows), len(slices), db_path))
 
-    partners = ["Fyber", "Fyber_Video", "MoPub"]
+def warehouse_cube(db_path, start_date, end_date):
+    """
+    Builds the rollup cube (see build_rollup_cube) for start_date..end_date
+    with one aggregate query against the warehouse, so the raw rows never
+    leave SQLite. Like build_rollup_cube, a missing UnitType / App is 
+    MISSING_DIMENSION and missing measures count as 0.
+    """
+    import pandas as pd
+    conn = warehouse_connection(db_path)
+    try:
+        cube = pd.read_sql_query("""
+            SELECT Day, Partner, 
+                   COALESCE(UnitType, :missing) AS UnitType, 
+                   COALESCE(App, :missing) AS App, 
+                   SUM(Total_Code_Served) AS Total_Code_Served, 
+                   SUM(Requests) AS Requests, 
+                   SUM(Impressions) AS Impressions, 
+                   SUM(Clicks) AS Clicks, 
+                   SUM(Revenue) AS Revenue
+            FROM revenue 
+            WHERE Day BETWEEN :start AND :end
+            GROUP BY 1, 2, 3, 4
+            ORDER BY 1, 2, 3, 4""", 
+            conn, params={'missing': MISSING_DIMENSION, 'start': start_date, 
+                          'end': end_date}, 
+            parse_dates=['Day'])
+    finally:
+        conn.close()
+    
+    cube[CUBE_MEASURES] = cube[CUBE_MEASURES].fillna(0)
+    return cube
 
-    hover = HoverTool(tooltips=
-                     [
-                         ('Date','@Day{ %F }'),
-                         ('MoPub','@MoPub{$0,0.00}'),
-                         ('Fyber Video','@Fyber_Video{$0,0.00}'),
-                         ('Fyber','@Fyber{$0,0.00}'),                     
-                         ('Total Revenue','@Total_Revenue{$0,0.00}'),
-                         ('Impressions', '@Impressions{0,}'),
-                     ],
+def bucket_size(days, max_points=400):
+    """
+    How many days go into each bar: 1 if `days` fits under max_points, 
+    else 7 (weeks), else 30 (months)
+    """
+    if max_points is None or days <= max_points:
+        return 1
+    if days / 7 <= max_points:
+        return 7
+    return 30
 
-                      formatters={'Day':'datetime'},
+def bucket_starts(days, bucket_days):
+    """
+    The first day of the week (starting Monday) or calendar month, per 
+    bucket_size, that each of days (a Series of dates) falls in
+    """
+    import pandas as pd
+    if bucket_days == 7:
+        return days - pd.to_timedelta(days.dt.dayofweek, unit='D')
+    return days.dt.to_period('M').dt.to_timestamp()
 
+def rebucket(dataframe, bucket_days):
+    """
+    Sums a per-day chart frame (a 'Day' column plus numbers) up to weeks 
+    (starting Monday) or calendar months, per bucket_size. The buckets are
+    labeled with their first day.
+    """
+    if bucket_days == 1:
+        return dataframe
+    
+    df = dataframe
+    buckets = bucket_starts(df['Day'], bucket_days)
+    df = df.drop(columns='Day').groupby(buckets.values).sum()
+    df = df.rename_axis('Day').reset_index()
+    return df
 
-                     )
+def compact_source(dataframe, columns):
+    """
+    A ColumnDataSource with only the columns a chart's glyphs / tooltips 
+    use. The numbers go in as float64 arrays (Day as datetime64), which 
+    Bokeh embeds in the html as base64 binary arrays. A whole DataFrame 
+    gets its index and every column embedded, with int64 columns written 
+    out as JSON lists. Text columns (names, colors) go in as lists.
+    """
+    from bokeh.models import ColumnDataSource
+    data = {}
+    for column in columns:
+        if column == 'Day':
+            data[column] = dataframe[column].values
+        elif dataframe[column].dtype.kind not in 'biuf':
+            data[column] = dataframe[column].astype(str).tolist()
+        else:
+            data[column] = dataframe[column].values.astype('float64')
+    return ColumnDataSource(data=data)
+
+def stack_names(present, expected):
+    """
+    The names to stack in a chart: everything in present plus anything in
+    expected that isn't, sorted so the stack order is the same every run.
+    """
+    names = [str(name) for name in present]
+    names += [name for name in expected if name not in names]
+    return sorted(names)
 
+def stack_colors(names, known_colors):
+    """
+    A color for each name, from known_colors where it has one and from the
+    Category20 palette for the rest.
+    """
+    from bokeh.palettes import Category20
+    spare = [color for color in Category20[20] 
+             if color not in known_colors.values()]
+    colors = []
+    for name in names:
+        if known_colors.get(name) is not None:
+            colors.append(known_colors[name])
+        else:
+            colors.append(spare[len(colors) % len(spare)])
+    return colors
+
+# The totals the KPIs are worked out from, the rolling windows (in days) 
+# and, for the charts, each KPI's label and number format
+KPI_MEASURES = ['Revenue', 'Impressions', 'Requests', 'Clicks']
+KPI_WINDOWS = [7, 28]
+KPI_CHARTS = [('eCPM', 'eCPM', '$0,0.00'), 
+              ('Fill_Rate', 'Fill Rate', '0.0%'), 
+              ('CTR', 'CTR', '0.00%')]
+
+def kpi_ratios(revenue, impressions, requests, clicks):
+    """
+    eCPM, fill rate (impressions / requests, since Total_Code_Served is 0
+    for the Fyber partners) and CTR of same-shaped frames of totals, as 
+    (name, frame) pairs. NaN where there's nothing to divide by.
+    """
+    def ratio(numerator, denominator):
+        return numerator / denominator.where(denominator > 0)
+    return [('eCPM', 1000 * ratio(revenue, impressions)), 
+            ('Fill_Rate', ratio(impressions, requests)), 
+            ('CTR', ratio(clicks, impressions))]
+
+def build_kpis(cube, dimensions=('Partner', 'UnitType', 'App')):
+    """
+    The yield KPIs for every day of the cube, for the total ('Total' / 
+    'All') and for each name of each of dimensions, in one frame with Day, 
+    Dimension and Name columns plus:
+    
+    - the KPI_MEASURES totals
+    - eCPM, Fill_Rate and CTR (see kpi_ratios)
+    - <KPI>_7d / <KPI>_28d, the KPI over the last 7 / 28 days (ratios of 
+      the rolling totals, so big days weigh more than small ones)
+    - Revenue_DoD / <KPI>_DoD, the change from the day before
+    
+    Each dimension is one wide Day x name frame per measure, so every KPI
+    is a handful of whole-frame operations, however many days and names 
+    there are. Days a name has no rows for count as 0, and every day x 
+    name gets a row, even when all its KPIs are NaN.
+    """
+    import pandas as pd
+    days = pd.date_range(cube['Day'].min(), cube['Day'].max(), name='Day')
+    frames = []
+    for dimension in ['Total'] + list(dimensions):
+        if dimension == 'Total':
+            totals = cube.groupby('Day')[KPI_MEASURES].sum()
+            totals.columns = pd.MultiIndex.from_product([KPI_MEASURES, 
+                                                         ['All']])
+        else:
+            totals = cube.groupby(['Day', dimension])[KPI_MEASURES].sum()
+            totals = totals.unstack(dimension)
+        totals = totals.reindex(days).fillna(0)
+        
+        measures = [totals[measure] for measure in KPI_MEASURES]
+        columns = dict(zip(KPI_MEASURES, measures))
+        daily = kpi_ratios(*measures)
+        columns.update(daily)
+        for window in KPI_WINDOWS:
+            rolled = [values.rolling(window, min_periods=1).sum() 
+                      for values in measures]
+            for name, values in kpi_ratios(*rolled):
+                columns['{}_{}d'.format(name, window)] = values
+        for name, values in [('Revenue', columns['Revenue'])] + daily:
+            columns[name + '_DoD'] = values.diff()
+        
+        # Day x name frames -> a row per day x name, laid out by hand 
+        # instead of with stack(), which drops the all-NaN rows (and has 
+        # changed what it does with them between pandas versions)
+        names = totals['Revenue'].columns
+        index = pd.MultiIndex.from_product([days, names], 
+                                           names=['Day', 'Name'])
+        df = pd.DataFrame({name: values.values.ravel() 
+                           for name, values in columns.items()}, 
+                          index=index).reset_index()
+        df.insert(1, 'Dimension', dimension)
+        frames.append(df)
+    
+    return pd.concat(frames, axis=0, ignore_index=True, sort=False)
+
+def styled_figure(title, hover, y_max, subtitle=None, y_label='Revenue', 
+                  y_format="$0,00.00"):
+    """
+    The figure every dashboard chart starts from: 1000x400, dates along 
+    the bottom, revenue (or y_label, in y_format) up the side from 0 to 
+    y_max, the hover tool plus the pan / zoom / save ones, and the gray 
+    arial title (with ' - subtitle' on the end if there is one)
+    """
+    from bokeh.models import (BoxZoomTool, NumeralTickFormatter, PanTool, 
+                              ResetTool, SaveTool, WheelZoomTool, ZoomInTool,
+                              ZoomOutTool)
+    from bokeh.plotting import figure
     p = figure(plot_width=1000, plot_height=400, x_axis_type='datetime', 
-               toolbar_location = 'above', tools=[hover], 
-               y_range = (0, df2['Total_Revenue'].max()+500))
+               toolbar_location='above', tools=[hover], y_range=(0, y_max))
 
     #Title
-    p.title.text = 'IMVU Mobile Ad Revenue by Date, Impressions'
+    p.title.text = title if subtitle is None else title + ' - ' + subtitle
     p.title.text_font = 'arial'
     p.title.text_color = 'gray'
 
     #Y-Axis
-    p.yaxis.axis_label = 'Revenue'
+    p.yaxis.axis_label = y_label
     p.yaxis.axis_label_text_font = 'arial'
     p.yaxis.axis_label_text_font_style = 'bold'
-    p.yaxis[0].formatter = NumeralTickFormatter(format="$0,00.00")
+    p.yaxis[0].formatter = NumeralTickFormatter(format=y_format)
 
     #X-Axis
     p.xaxis.axis_label = 'Date'
@@ -320,13 +2280,8 @@ def bokeh_dashboard_creator(dataframe):
     p.xgrid.grid_line_color = None
 
     #Tools
-    p.add_tools(PanTool())
-    p.add_tools(BoxZoomTool())
-    p.add_tools(WheelZoomTool())
-    p.add_tools(ZoomInTool())
-    p.add_tools(ZoomOutTool())
-    p.add_tools(ResetTool())
-    p.add_tools(SaveTool())
+    p.add_tools(PanTool(), BoxZoomTool(), WheelZoomTool(), ZoomInTool(), 
+                ZoomOutTool(), ResetTool(), SaveTool())
     p.toolbar.logo = None
 
     #Misc
@@ -334,8 +2289,104 @@ def bokeh_dashboard_creator(dataframe):
     p.x_range.range_padding = 0.1
     p.axis.minor_tick_line_color = None
     p.outline_line_color = None
+    return p
+
+def style_legend(p):
+    """Puts p's legend along the top, clicking an entry hides its glyphs"""
+    p.legend.location = 'top_center'
+    p.legend.orientation = "horizontal"
+    p.legend.click_policy = 'hide'
 
-    p.vbar_stack(stackers=partners, x='Day', width=36000000, color=colors, 
+def dashboard_layout(cube, csv=False, max_points=400, subtitle=None):
+    """
+    This creates the charts / graphs based off the rollup cube (see 
+    build_rollup_cube) of the data we pulled from the various APIs and, 
+    if csv is True, writes the data to csv files for further analysis. 
+    Bokeh makes JavaScript charts that are interactive and look much 
+    slicker than, say, matplotlib. It's also a lot more complicated
+    and with many more lines of code. This func. makes three charts:
+    
+    1. Revenue, Impressions by Day by Partner
+    2. Revenue by Day by Ad Unit Type 
+    3. Revenue by App
+    4. eCPM, Fill Rate and CTR by Partner (see build_kpis)
+    
+    The code for each is seperated by number-sign boxes. 
+    
+    Ranges with more than max_points days are charted by week / month (see
+    bucket_size). The csv files always stay per day. Every chart is a 
+    styled_figure, so they all look alike, and subtitle (e.g. 
+    'Country US') goes on the end of their titles.
+    """
+    import pandas as pd
+    from bokeh.core.properties import value
+    from bokeh.layouts import column
+    from bokeh.models import HoverTool, LinearAxis, NumeralTickFormatter, Range1d
+    ############################################
+    # Revenue, Impressions by Day by Partner
+    ############################################
+    
+    df = cube
+    
+    df_day = df.groupby('Day')[['Impressions', 'Revenue']].sum()
+    bucket_days = bucket_size(len(df_day), max_points)
+    bar_width = 36000000 * bucket_days
+    impressions_list = df_day['Impressions'].tolist()
+    revenue_list = df_day['Revenue'].tolist()
+
+    df_pivot = df.pivot_table(index=['Day'], columns='Partner', 
+                              values=['Revenue'], aggfunc='sum')
+
+    # Every partner in the data gets a stack, and a registered partner that
+    # failed to fetch still gets an (all zero) one, so the legend doesn't 
+    # jump around from one run to the next
+    partners = stack_names(df_pivot['Revenue'].columns, 
+                           [c.partner for c in CONNECTORS])
+    df_pivot = df_pivot.reindex(columns=pd.MultiIndex.from_product(
+        [['Revenue'], partners], names=[None, 'Partner']))
+
+    df_pivot = df_pivot.fillna(0)
+
+    df_pivot['Impressions'] = impressions_list
+    df_pivot['Total_Revenue'] = revenue_list
+    
+    if csv:
+        df_pivot.to_csv("revenue-by-day-by-partner.csv")
+    
+    # Flattens ('Revenue', partner) down to just the partner name
+    df2 = df_pivot['Revenue'].copy()
+    df2['Impressions'] = impressions_list
+    df2['Total_Revenue'] = revenue_list
+    df2 = df2.reset_index()
+    df2.columns.name = None
+    df2 = rebucket(df2, bucket_days)
+
+    colors = stack_colors(partners, {c.partner: c.color for c in CONNECTORS})
+
+    source = compact_source(df2, ['Day'] + partners + 
+                            ['Impressions', 'Total_Revenue'])
+
+    # Top of the stack first, labelled with the connector's name
+    partner_names = {c.partner: c.name for c in CONNECTORS}
+    hover = HoverTool(tooltips=
+                     [('Date','@Day{ %F }')] + 
+                     [(partner_names.get(partner, partner), 
+                       '@{' + partner + '}{$0,0.00}') 
+                      for partner in reversed(partners)] + 
+                     [
+                         ('Total Revenue','@Total_Revenue{$0,0.00}'),
+                         ('Impressions', '@Impressions{0,}'),
+                     ],
+
+                      formatters={'Day':'datetime'},
+
+
+                     )
+
+    p = styled_figure('IMVU Mobile Ad Revenue by Date, Impressions', hover, 
+                      df2['Total_Revenue'].max()+500, subtitle)
+
+    p.vbar_stack(stackers=partners, x='Day', width=bar_width, color=colors, 
                  source=source,  legend=[value(x) for x in partners], 
                  name=partners)
 
@@ -353,11 +2404,7 @@ def bokeh_dashboard_creator(dataframe):
            color='navy', y_range_name = 'Impression_Range', 
            legend='Impression')
 
-    #Legend Formatting
-    # p.legend.location = "top_left"
-    p.legend.location = 'top_center'
-    p.legend.orientation = "horizontal"
-    p.legend.click_policy = 'hide'
+    style_legend(p)
     
     ############################################
     # Revenue by Day by Ad Unit Type
@@ -366,28 +2413,29 @@ def bokeh_dashboard_creator(dataframe):
     df_unittype_pivot = df.pivot_table(index='Day', columns='UnitType', 
                                        values='Revenue', aggfunc='sum')
 
-    df_unittype_pivot['Total_Revenue'] = revenue_list
-
-    df_unittype_pivot.to_csv("revenue-by-day-by-adtype.csv")
-
-    df3 = pd.read_csv("revenue-by-day-by-adtype.csv")
+    ad_type = stack_names(df_unittype_pivot.columns, 
+                          ["banner", "native", "video"])
+    df_unittype_pivot = df_unittype_pivot.reindex(columns=ad_type)
 
-    df3['Total_Revenue'].max()
+    df_unittype_pivot['Total_Revenue'] = revenue_list
 
-    df3['Day'] = pd.to_datetime(df3['Day'])
+    if csv:
+        df_unittype_pivot.to_csv("revenue-by-day-by-adtype.csv")
 
-    source2 = ColumnDataSource(df3)
-    ad_type = ["banner", "native", "video"]
-    pastel_colors = ["#a8e6cf", "#ffd3b6", "#ffaaa5"]
+    df3 = df_unittype_pivot.reset_index()
+    df3.columns.name = None
+    df3 = rebucket(df3, bucket_days)
 
-    df3.head(1)
+    source2 = compact_source(df3, ['Day'] + ad_type + ['Total_Revenue'])
+    pastel_colors = stack_colors(ad_type, {"banner": "#a8e6cf", 
+                                           "native": "#ffd3b6", 
+                                           "video": "#ffaaa5"})
 
     hover2 = HoverTool(
         tooltips=
+        [(unit_type.capitalize(), '@{' + unit_type + '}{$0,0.00}') 
+         for unit_type in reversed(ad_type)] + 
         [
-          ('Video','@video{$0,0.00}'),
-          ('Native','@native{$0,0.00}'),
-          ('Banner','@banner{$0,0.00}'),
           ('Total Revenue', '@Total_Revenue{$0,0.00}'),
           ('Date','@Day{ %F }'),
         ],
@@ -396,55 +2444,13 @@ def bokeh_dashboard_creator(dataframe):
 
     )
 
-    p2 = figure(plot_width = 1000, plot_height=400, x_axis_type='datetime', 
-                title="Ads By Day", toolbar_location='above', 
-                tools=[hover2], y_range=(0,df3['Total_Revenue'].max()+500))
+    p2 = styled_figure('IMVU Mobile Ad Revenue by Type, Date', hover2, 
+                       df3['Total_Revenue'].max()+500, subtitle)
 
-    p2.vbar_stack(stackers=ad_type, x='Day', width=36000000, color=pastel_colors,
+    p2.vbar_stack(stackers=ad_type, x='Day', width=bar_width, color=pastel_colors,
                   source=source2, legend=[value(x) for x in ad_type], 
                   name=ad_type)
-
-    #Title
-    p2.title.text = 'IMVU Mobile Ad Revenue by Type, Date'
-    p2.title.text_font = 'arial'
-    p2.title.text_color = 'gray'
-    #p.title.text_font_style = 'bold'
-
-    #Y-Axis
-    p2.yaxis.axis_label = 'Revenue'
-    p2.yaxis.axis_label_text_font = 'arial'
-    p2.yaxis.axis_label_text_font_style = 'bold'
-    p2.yaxis[0].formatter = NumeralTickFormatter(format="$0,00.00")
-
-    #X-Axis
-    p2.xaxis.axis_label = 'Date'
-    p2.xaxis.axis_label_text_font = 'arial'
-    p2.xaxis.axis_label_text_font_style = 'bold'
-    p2.xaxis.major_label_text_color = 'black'
-
-    #Removes X-Grid Line
-    p2.xgrid.grid_line_color = None
-
-    #Tools
-    p2.add_tools(PanTool())
-    p2.add_tools(BoxZoomTool())
-    p2.add_tools(WheelZoomTool())
-    p2.add_tools(ZoomInTool())
-    p2.add_tools(ZoomOutTool())
-    p2.add_tools(ResetTool())
-    p2.add_tools(SaveTool())
-    p2.toolbar.logo = None
-
-    #Misc
-    p2.y_range.start = 0
-    p2.x_range.range_padding = 0.1
-    p2.axis.minor_tick_line_color = None
-    p2.outline_line_color = None
-
-    #Legend Formatting
-    p2.legend.location = 'top_center'
-    p2.legend.orientation = "horizontal"
-    p2.legend.click_policy = 'hide'
+    style_legend(p2)
 
     ############################################
     # Revenue by Day by App
@@ -454,45 +2460,30 @@ def bokeh_dashboard_creator(dataframe):
                                   values=['Revenue', 'Impressions'], 
                                   aggfunc='sum')
 
-    df_app_pivot.to_csv("revenue-by-day-by-app.csv")
-
-    df4 = pd.read_csv("revenue-by-day-by-app.csv", skiprows=2)
+    if csv:
+        df_app_pivot.to_csv("revenue-by-day-by-app.csv")
 
+    # Every app in the data gets a stack (an account's own apps, the video
+    # wall, ...), and the two IMVU apps always do, like the partners above
+    apps = stack_names(df_app_pivot['Revenue'].columns, 
+                       ["IMVU Android", "IMVU iOS"])
+    df4 = df_app_pivot['Revenue'].reindex(columns=apps)
     df4 = df4.fillna(0)
+    df4['Total_Revenue'] = revenue_list
+    df4 = df4.reset_index()
+    df4.columns.name = None
+    df4 = rebucket(df4, bucket_days)
 
-    col_idx = 0
-    bad_column_list = []
-
-    for c in list(df4.columns):
-        if df4.loc[0, c] == 0.0:
-            bad_column_list.append(col_idx)
-        col_idx += 1
-
-    columns_to_delete = [list(df4.columns)[num] for num in bad_column_list]
-
-    for c in columns_to_delete:
-        del df4[c]
-
-    df4.columns = ["Day", "IMVU_Android_Impressions", "IMVU_iOS_Impressions", 
-                   "IMVU_Android_Revenue", "IMVU_iOS_Revenue"]
-
-    df4['Day'] = pd.to_datetime(df4['Day'])
+    os_colors = stack_colors(apps, {"IMVU Android": "#ff5d5d", 
+                                    "IMVU iOS": "#84b9ef"})
 
-    # turn impressions to integer?
-
-    df4["Total_Revenue"] = df4["IMVU_Android_Revenue"] + df4["IMVU_iOS_Revenue"]
-    df4["Total_Impressions"] = df4["IMVU_Android_Impressions"] + df4["IMVU_iOS_Impressions"]
-
-    os_colors = ["#ff5d5d", "#84b9ef"]
-    ad_type = ['IMVU_Android_Revenue', 'IMVU_iOS_Revenue']
-
-    source3 = ColumnDataSource(df4)
+    source3 = compact_source(df4, ['Day'] + apps + ['Total_Revenue'])
 
     hover3 = HoverTool(
         tooltips=
+        [('{} Revenue'.format(app), '@{' + app + '}{$0,0.00}') 
+         for app in reversed(apps)] + 
         [
-          ('iOS Revenue','@IMVU_iOS_Revenue{$0,0.00}'),
-          ('Android Revenue','@IMVU_Android_Revenue{$0,0.00}'),
           ('Total Revenue', '@Total_Revenue{$0,0.00}'),
           ('Date','@Day{ %F }'),
         ],
@@ -501,102 +2492,892 @@ def bokeh_dashboard_creator(dataframe):
 
     )
 
-    p3 = figure(plot_width = 1000, plot_height=400, x_axis_type='datetime', 
-                title="Ads By Day", toolbar_location='above', 
-                tools=[hover3], y_range=(0,df4['Total_Revenue'].max()+500))
+    p3 = styled_figure('IMVU Mobile Ad Revenue by App, Date', hover3, 
+                       df4['Total_Revenue'].max()+500, subtitle)
 
-    p3.vbar_stack(stackers=ad_type, x='Day', width=36000000, color=os_colors, 
-                  source=source3, alpha=0.6, legend=[value(x) for x in ad_type], 
-                  name=ad_type)
+    p3.vbar_stack(stackers=apps, x='Day', width=bar_width, color=os_colors, 
+                  source=source3, alpha=0.6, legend=[value(x) for x in apps], 
+                  name=apps)
+    style_legend(p3)
 
-    #Title
-    p3.title.text = 'IMVU Mobile Ad Revenue by App, Date'
-    p3.title.text_font = 'arial'
-    p3.title.text_color = 'gray'
-    #p.title.text_font_style = 'bold'
-
-    #Y-Axis
-    p3.yaxis.axis_label = 'Revenue'
-    p3.yaxis.axis_label_text_font = 'arial'
-    p3.yaxis.axis_label_text_font_style = 'bold'
-    p3.yaxis[0].formatter = NumeralTickFormatter(format="$0,00.00")
-
-    #X-Axis
-    p3.xaxis.axis_label = 'Date'
-    p3.xaxis.axis_label_text_font = 'arial'
-    p3.xaxis.axis_label_text_font_style = 'bold'
-    p3.xaxis.major_label_text_color = 'black'
-
-    #Removes X-Grid Line
-    p3.xgrid.grid_line_color = None
+    ############################################
+    # eCPM, Fill Rate, CTR by Partner
+    ############################################
 
-    #Tools
-    p3.add_tools(PanTool())
-    p3.add_tools(BoxZoomTool())
-    p3.add_tools(WheelZoomTool())
-    p3.add_tools(ZoomInTool())
-    p3.add_tools(ZoomOutTool())
-    p3.add_tools(ResetTool())
-    p3.add_tools(SaveTool())
-    p3.toolbar.logo = None
+    # The csv gets every dimension, the charts only need the partners
+    kpis = build_kpis(cube, ['Partner', 'UnitType', 'App'] if csv 
+                      else ['Partner'])
+
+    if csv:
+        kpis.to_csv("kpis-by-day.csv", index=False)
+
+    # Charted by week / month, there's a point per bar: the 28 day KPI as 
+    # of the bucket's last day, put on its first day like rebucket's bars
+    window = 7 if bucket_days == 1 else 28
+    partner_kpis = kpis[kpis['Dimension'] == 'Partner']
+    kpi_charts = []
+    for kpi, label, number_format in KPI_CHARTS:
+        df5 = partner_kpis.pivot(index='Day', columns='Name', 
+                                 values='{}_{}d'.format(kpi, window))
+        df5 = df5.reindex(columns=partners)
+        if bucket_days > 1:
+            starts = bucket_starts(df5.index.to_series(), bucket_days)
+            last_days = ~starts.duplicated(keep='last')
+            df5 = df5[last_days.values]
+            df5.index = pd.DatetimeIndex(starts[last_days].values, name='Day')
+        df5 = df5.reset_index()
+        df5.columns.name = None
+
+        hover4 = HoverTool(
+            tooltips=
+            [('Date', '@Day{ %F }')] + 
+            [(partner_names.get(partner, partner), 
+              '@{' + partner + '}{' + number_format + '}') 
+             for partner in reversed(partners)],
+
+            formatters={'Day':'datetime'}
+
+        )
+
+        y_max = df5[partners].max().max()
+        p4 = styled_figure('IMVU Mobile Ad {} by Partner, {} Day Average'.format(
+                               label, window), 
+                           hover4, y_max * 1.2 if y_max > 0 else 1, subtitle,
+                           y_label=label, y_format=number_format)
+
+        source4 = compact_source(df5, ['Day'] + partners)
+        for partner, color in zip(partners, colors):
+            p4.line(x='Day', y=partner, source=source4, line_width=2, 
+                    color=color, 
+                    legend=value(partner_names.get(partner, partner)))
+        style_legend(p4)
+        kpi_charts.append(p4)
+
+    return column(p, p2, p3, *kpi_charts)
+
+def bokeh_dashboard_creator(cube, csv=False, max_points=400, 
+                            open_browser=True):
+    """
+    Writes the dashboard (see dashboard_layout) to dashboard.html and, with
+    open_browser, opens it
+    """
+    from bokeh.io import output_file, save, show
+    with stage('chart layout'):
+        layout = dashboard_layout(cube, csv=csv, max_points=max_points)
+    with stage('write html'):
+        output_file("dashboard.html")
+        if open_browser:
+            show(layout)
+        else:
+            save(layout)
 
-    #Misc
-    p3.y_range.start = 0
-    p3.x_range.range_padding = 0.1
-    p3.axis.minor_tick_line_color = None
-    p3.outline_line_color = None
+# Which cube column each kind of dashboard variant is split by
+VARIANT_COLUMNS = {'app': 'App', 'partner': 'Partner', 'country': 'Country'}
 
-    #Legend Formatting
-    # p3.legend.location = "top_left"
-    p3.legend.location = 'top_center'
-    p3.legend.orientation = "horizontal"
-    p3.legend.click_policy = 'hide'    
+def dashboard_variants(cube, country_cube, kinds, dashboard_dir='dashboards',
+                       countries=None):
+    """
+    The dashboards batch_render_dashboards writes, as (subtitle, html path,
+    cube) tuples: the combined one ('all') and one per app / partner / 
+    country in the data, for each of kinds. country_cube is the cube with
+    Country kept (see build_rollup_cube), the per country ones come out of
+    it. countries limits those to just the listed country codes.
+    """
+    variants = []
+    if 'all' in kinds:
+        variants.append((None, os.path.join(dashboard_dir, 'all.html'), cube))
+    
+    for kind in ['app', 'partner', 'country']:
+        if kind not in kinds:
+            continue
+        column = VARIANT_COLUMNS[kind]
+        source = country_cube if kind == 'country' else cube
+        for name, variant_cube in source.groupby(column, sort=True):
+            if kind == 'country' and countries and name not in countries:
+                continue
+            file_name = '{}-{}.html'.format(kind, 
+                                            re.sub(r'\W+', '_', str(name)))
+            variants.append(('{} {}'.format(kind.capitalize(), name), 
+                             os.path.join(dashboard_dir, file_name), 
+                             variant_cube.reset_index(drop=True)))
+    return variants
+
+def render_variant(variant, max_points=400):
+    """
+    Writes one dashboard variant (see dashboard_variants) to its html file.
+    Runs in a render_dashboards worker process, so it only gets (and 
+    returns) plain picklable values. Returns the path and the seconds it 
+    took.
+    """
+    from bokeh.io import save
+    from bokeh.resources import CDN
+    started = time.perf_counter()
+    subtitle, path, cube = variant
+    layout = dashboard_layout(cube, max_points=max_points, subtitle=subtitle)
+    title = 'IMVU Mobile Ad Revenue'
+    if subtitle is not None:
+        title += ' - ' + subtitle
+    save(layout, filename=path, resources=CDN, title=title)
+    return path, time.perf_counter() - started
+
+def write_dashboard_index(variants, dashboard_dir='dashboards'):
+    """Writes index.html, a page linking to every dashboard variant"""
+    links = ['<li><a href="{}">{}</a></li>'.format(
+                 os.path.basename(path), subtitle or 'All')
+             for subtitle, path, cube in variants]
+    with open(os.path.join(dashboard_dir, 'index.html'), 'w') as f:
+        f.write('<html><head><title>IMVU Mobile Ad Revenue</title></head>\n'
+                '<body><h1>IMVU Mobile Ad Revenue</h1><ul>\n{}\n</ul>'
+                '</body></html>\n'.format('\n'.join(links)))
+
+def render_dashboards(variants, max_points=400, render_workers=0, 
+                      dashboard_dir='dashboards'):
+    """
+    Writes every dashboard variant to html in a pool of render_workers 
+    processes (0 = one per CPU). Laying out the charts and serializing 
+    them is pure Python, so threads would just take turns on the GIL. 
+    bokeh is imported before the pool starts, so workers forked off this
+    process already have it loaded.
+    """
+    importlib.import_module('bokeh.plotting')
+    os.makedirs(dashboard_dir, exist_ok=True)
+    render_workers = render_workers or os.cpu_count() or 1
+    
+    with stage('render {} dashboards'.format(len(variants))) as record:
+        if render_workers == 1:
+            results = [render_variant(variant, max_points) 
+                       for variant in variants]
+        else:
+            with ProcessPoolExecutor(max_workers=render_workers) as executor:
+                results = list(executor.map(render_variant, variants, 
+                                            [max_points] * len(variants)))
+        record['rows'] = len(results)
+        write_dashboard_index(variants, dashboard_dir)
+    
+    slowest = max(results, key=lambda result: result[1]) if results else None
+    print("Wrote {} dashboards to {} with {} workers{}".format(
+        len(results), dashboard_dir, render_workers, 
+        " (slowest: {} in {:.2f}s)".format(*slowest) if slowest else ''))
+
+def batch_render_dashboards(start_date, end_date, store_dir='revenue_store',
+                            kinds=('all', 'app', 'partner', 'country'), 
+                            countries=None, dashboard_dir='dashboards', 
+                            max_points=400, render_workers=0):
+    """
+    Builds the data for start_date..end_date once, from the Parquet store
+    (no API calls), then writes a dashboard per app / partner / country 
+    (see dashboard_variants) in parallel, plus an index.html linking to
+    them.
+    """
+    with stage('read store') as record:
+        df = read_fact_store(store_dir, start_date, end_date)
+        record['rows'] = len(df)
+    if df.empty:
+        print("Nothing in {} for {} to {}. Run the dashboard for those " \
+              "days first.".format(store_dir, start_date, end_date))
+        return
+    
+    with stage('rollup cube') as record:
+        cube = build_rollup_cube(df)
+        country_cube = None
+        if 'country' in kinds:
+            country_cube = build_rollup_cube(df, CUBE_DIMENSIONS + ['Country'])
+        record['rows'] = len(cube)
+    del df
+    
+    variants = dashboard_variants(cube, country_cube, kinds, 
+                                  dashboard_dir=dashboard_dir, 
+                                  countries=countries)
+    render_dashboards(variants, max_points=max_points, 
+                      render_workers=render_workers, 
+                      dashboard_dir=dashboard_dir)
+
+def change_figure(title, changes):
+    """
+    A horizontal bar per row of changes (see drilldown_changes), green for
+    up and red for down, biggest change at the top
+    """
+    from bokeh.models import HoverTool, NumeralTickFormatter
+    from bokeh.plotting import figure
+    df = changes.iloc[::-1].reset_index()
+    df.columns = ['Name'] + list(df.columns[1:])
+    df['Color'] = ['#1a9641' if change >= 0 else '#d7191c' 
+                   for change in df['Change']]
+    
+    hover = HoverTool(tooltips=[('', '@Name'), 
+                                ('Revenue', '@Revenue{$0,0.00}'),
+                                ('Day Before', '@Previous_Revenue{$0,0.00}'),
+                                ('Change', '@Change{$0,0.00}')])
+    p = figure(plot_width=1000, plot_height=400, y_range=list(df['Name']),
+               toolbar_location='above', tools=[hover], title=title)
+    p.hbar(y='Name', right='Change', height=0.8, color='Color', 
+           source=compact_source(df, list(df.columns)))
+    
+    p.title.text_font = 'arial'
+    p.title.text_color = 'gray'
+    p.xaxis.axis_label = 'Revenue Change'
+    p.xaxis.axis_label_text_font = 'arial'
+    p.xaxis.axis_label_text_font_style = 'bold'
+    p.xaxis[0].formatter = NumeralTickFormatter(format="$0,00.00")
+    p.ygrid.grid_line_color = None
+    p.toolbar.logo = None
+    p.outline_line_color = None
+    return p
 
+def drilldown_layout(drilldown, top, start_date, end_date, top_n=10, 
+                     csv=False, **filters):
+    """
+    The drilldown page for the last day of the range: 
+    
+    1. Revenue change vs. the day before by Country
+    2. Revenue change vs. the day before by Ad Unit
+    3. Revenue by Day of that day's top_n countries (from the precomputed
+       top table, or the filtered slice's own), over the whole range
+    
+    filters (country / ad_unit / partner) narrow every chart down, like 
+    drilldown_query's. With csv the change tables are written to 
+    drilldown-by-country.csv / drilldown-by-adunit.csv.
+    """
+    import pandas as pd
     from bokeh.layouts import column
+    from bokeh.models import HoverTool
+    day = pd.Timestamp(end_date)
+    subtitle = ', '.join('{} {}'.format(name.replace('_', ' ').title(), 
+                                        value if isinstance(value, str) 
+                                        else '/'.join(value))
+                         for name, value in sorted(filters.items()) 
+                         if value) or None
+    
+    charts = []
+    for by, label in [('Country', 'country'), ('AdUnit', 'adunit')]:
+        changes = drilldown_changes(drilldown, day, by=by, top_n=top_n, 
+                                    **filters)
+        if csv:
+            changes.to_csv('drilldown-by-{}.csv'.format(label))
+        title = 'Revenue Change by {} on {:%Y-%m-%d}'.format(
+            'Ad Unit' if by == 'AdUnit' else by, day)
+        if subtitle is not None:
+            title += ' - ' + subtitle
+        charts.append(change_figure(title, changes))
     
-    show(column(p, p2, p3))
+    countries = list(top.loc[(top['Day'] == day) & 
+                             (top['Dimension'] == 'Country'), 'Name'])
+    if any(filters.values()):
+        # the precomputed top is over everything, not the filtered slice
+        countries = list(drilldown_query(drilldown, day, day, **filters).index)
+    countries = countries[:top_n]
+    
+    by_day = drilldown_query(drilldown, start_date, end_date, 
+                             by=['Day', 'Country'], **filters)['Revenue']
+    df = by_day.unstack('Country').reindex(columns=countries).fillna(0)
+    df = df.sort_index().reset_index()
+    df.columns = ['Day'] + ['c{}'.format(num) for num in range(len(countries))]
+    
+    hover = HoverTool(tooltips=[('Date', '@Day{ %F }')] + 
+                      [(country, '@c{}{{$0,0.00}}'.format(num)) 
+                       for num, country in enumerate(countries)],
+                      formatters={'Day': 'datetime'})
+    y_max = df[df.columns[1:]].max().max() if countries else 0
+    p = styled_figure('IMVU Mobile Ad Revenue by Country, Date', hover, 
+                      (y_max if y_max == y_max else 0) * 1.1 + 1, subtitle)
+    source = compact_source(df, list(df.columns))
+    for num, (country, color) in enumerate(zip(countries, 
+                                               stack_colors(countries, {}))):
+        p.line(x='Day', y='c{}'.format(num), source=source, line_width=2, 
+               color=color, legend=country)
+    if countries:
+        style_legend(p)
+    charts.append(p)
+    return column(*charts)
+
+def drilldown_dashboard(start_date, end_date, 
+                        drilldown_dir='revenue_drilldown', top_n=10, 
+                        csv=False, open_browser=True, **filters):
+    """
+    Prints which countries / ad units moved revenue the most on end_date
+    and writes the drilldown charts (see drilldown_layout) to 
+    drilldown.html, all from the drilldown store (no API calls)
+    """
+    import pandas as pd
+    from bokeh.io import output_file, save, show
+    if not os.path.exists(drilldown_dir):
+        print("There's no drilldown store at {}. Run the dashboard first." \
+              .format(drilldown_dir))
+        return
+    
+    with stage('read drilldown') as record:
+        drilldown, top = read_drilldown(drilldown_dir, start_date, end_date)
+        record['rows'] = len(drilldown)
+    if drilldown.empty:
+        print("Nothing in {} for {} to {}. Run the dashboard for those " \
+              "days first.".format(drilldown_dir, start_date, end_date))
+        return
+    
+    with stage('drilldown queries'):
+        for by in ['Country', 'AdUnit']:
+            started = time.perf_counter()
+            changes = drilldown_changes(drilldown, end_date, by=by, 
+                                        top_n=top_n, **filters)
+            print("\nBiggest revenue changes by {} on {} ({:.1f} ms):".format(
+                by, end_date, 1000 * (time.perf_counter() - started)))
+            with pd.option_context('display.float_format', '{:,.2f}'.format):
+                print(changes.to_string() if len(changes) else "(no data)")
+    
+    with stage('chart layout'):
+        layout = drilldown_layout(drilldown, top, start_date, end_date, 
+                                  top_n=top_n, csv=csv, **filters)
+    with stage('write html'):
+        output_file("drilldown.html")
+        if open_browser:
+            show(layout)
+        else:
+            save(layout)
 
-def revenue_performance_dashboard(start_date, end_date):
-    if 'add_key_here' not in api_keys():
-        (mopub_api_key, mopub_inventory_report_id, fyber_video_username, 
-        fyber_video_password, fyber_display_publisher_id, 
-        fyber_display_consumer_key, fyber_display_consumer_secret) = api_keys()
+def serve_dashboard(start_date, end_date, fetch_options, 
+                    cube_path='revenue_cube.parquet', port=5006, 
+                    refresh_minutes=60, max_points=400, allow_origin=None):
+    """
+    Runs the dashboard on a Bokeh server (tornado, which Bokeh already 
+    pulls in) instead of writing dashboard.html. The rollup cube is loaded 
+    once (from cube_path, or fetched if there isn't one) and kept in 
+    memory for every viewer, so opening the page or changing the date 
+    range / partner / app filters only re-pivots the in-memory cube.
+    
+    If the API keys are set, a background thread fetches the days since 
+    the cube's last day (plus the refetch window, since SSPs restate) 
+    every refresh_minutes, merges them into the cube and saves it. Open 
+    pages pick the new data up within a minute.
+    """
+    import pandas as pd
+    from bokeh.application import Application
+    from bokeh.application.handlers.function import FunctionHandler
+    from bokeh.layouts import column, row
+    from bokeh.models import CheckboxGroup, DateRangeSlider, Div
+    from bokeh.server.server import Server
+    
+    state = {'cube': None, 'version': 0}
+    lock = threading.Lock()
+    if fetch_options.get('accounts') is None:
+        fetch_options = dict(fetch_options, accounts=local_accounts())
+    can_fetch = bool(fetch_options['accounts'])
+    if can_fetch:
+        # Before the refresh thread starts, see load_fetch_dependencies
+        load_fetch_dependencies()
+    
+    if os.path.exists(cube_path):
+        state['cube'] = read_cube(cube_path, start_date, end_date)
+    elif can_fetch:
+        df_concat = collect_partner_data(start_date, end_date, **fetch_options)
+        if df_concat is not None:
+            state['cube'] = build_rollup_cube(df_concat)
+            write_cube(state['cube'], cube_path)
+    
+    if state['cube'] is None or state['cube'].empty:
+        print("There's no data to serve for {} to {}.".format(start_date, end_date))
+        return
+    
+    def refresh():
+        with lock:
+            cube = state['cube']
+        refetch_days = fetch_options.get('refetch_days', 3)
+        first_day = cube['Day'].max() - pd.Timedelta(days=refetch_days)
+        first_day = max(first_day.strftime('%Y-%m-%d'), start_date)
+        last_day = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+        if first_day > last_day:
+            return
         
+        df_concat = collect_partner_data(first_day, last_day, **fetch_options)
+        if df_concat is None:
+            return
+        new_cube = build_rollup_cube(df_concat)
+        write_cube(new_cube, cube_path)
+        
+        cube = replace_slices(cube, new_cube)
+        cube = cube.sort_values(CUBE_DIMENSIONS).reset_index(drop=True)
+        with lock:
+            state['cube'] = cube
+            state['version'] += 1
+        print("Refreshed the dashboard data from {} to {}".format(
+            first_day, last_day))
+    
+    def refresh_loop():
+        while True:
+            try:
+                refresh()
+            except Exception as e:
+                print("Refreshing the dashboard data failed: {!r}".format(e))
+            time.sleep(refresh_minutes * 60)
+    
+    def make_document(doc):
+        with lock:
+            cube = state['cube']
+            seen_version = [state['version']]
+        
+        partners = sorted(cube['Partner'].astype(str).unique())
+        apps = sorted(cube['App'].astype(str).unique())
+        
+        date_slider = DateRangeSlider(title='Dates', start=cube['Day'].min(), 
+                                      end=cube['Day'].max(), step=1, width=1000,
+                                      value=(cube['Day'].min(), cube['Day'].max()))
+        partner_boxes = CheckboxGroup(labels=partners, inline=True,
+                                      active=list(range(len(partners))))
+        app_boxes = CheckboxGroup(labels=apps, inline=True, 
+                                  active=list(range(len(apps))))
+        charts = column(dashboard_layout(cube, max_points=max_points))
+        
+        def redraw(attr, old, new):
+            with lock:
+                cube = state['cube']
+            
+            # The slider hands back datetimes from Python, milliseconds from JS
+            first_day, last_day = [
+                pd.Timestamp(value, unit='ms') if isinstance(value, (int, float))
+                else pd.Timestamp(value) for value in date_slider.value]
+            chosen_partners = [partners[num] for num in partner_boxes.active]
+            chosen_apps = [apps[num] for num in app_boxes.active]
+            
+            chosen = (cube['Day'].between(first_day.normalize(), last_day) & 
+                      cube['Partner'].astype(str).isin(chosen_partners) & 
+                      cube['App'].astype(str).isin(chosen_apps))
+            if chosen.any():
+                charts.children = [dashboard_layout(cube[chosen], 
+                                                    max_points=max_points)]
+            else:
+                charts.children = [Div(text="No revenue for these filters.")]
+        
+        def check_for_new_data():
+            with lock:
+                cube = state['cube']
+                version = state['version']
+            if version != seen_version[0]:
+                seen_version[0] = version
+                date_slider.end = cube['Day'].max()
+                redraw('data', None, None)
+        
+        date_slider.on_change('value', redraw)
+        partner_boxes.on_change('active', redraw)
+        app_boxes.on_change('active', redraw)
+        doc.add_periodic_callback(check_for_new_data, 60000)
+        
+        doc.title = 'Mobile Ad Revenue'
+        doc.add_root(column(date_slider, row(partner_boxes, app_boxes), charts))
+    
+    if can_fetch:
+        threading.Thread(target=refresh_loop, daemon=True).start()
+    
+    server = Server({'/': Application(FunctionHandler(make_document))}, 
+                    port=port, allow_websocket_origin=[
+                        'localhost:{}'.format(port)] + (allow_origin or []))
+    server.start()
+    print("Serving the dashboard at http://localhost:{}/".format(port))
+    server.io_loop.start()
+
+def run_source(account, start_date, end_date, options):
+    """
+    Runs one account's fetch -> normalize chain and times it. Errors are 
+    caught and handed back instead of raised, so one broken partner / 
+    account doesn't throw away the data the others returned. A named 
+    account gets its own folders under cache_dir / checkpoint_dir, so two
+    accounts of one SSP don't read each other's reports.
+    """
+    connector = account.connector
+    label = account_label(account)
+    options = dict(options)
+    if account.name is not None:
+        folder = re.sub(r'\W+', '_', account.name)
+        for option in ['cache_dir', 'checkpoint_dir']:
+            if options.get(option) is not None:
+                options[option] = os.path.join(options[option], folder)
+    if connector.max_workers is not None:
+        options['workers'] = min(options.get('workers', 4), 
+                                 connector.max_workers)
+    if connector.rate_limit is not None:
+        options['rate_limit'] = connector.rate_limit
+    
+    start = time.time()
+    try:
+        with stage('fetch ' + label) as record:
+            raw = connector.fetch(start_date, end_date, account.credentials, 
+                                  **options)
+            record['rows'] = len(raw)
+        with stage('clean ' + label) as record:
+            if account.app_names is None:
+                df = connector.normalize(raw)
+            else:
+                df = connector.normalize(raw, app_names=account.app_names)
+            record['memory_mb_before'] = round(memory_mb(df), 2)
+            df = check_schema(connector, df.assign(Account=label))
+            record['memory_mb_after'] = round(memory_mb(df), 2)
+            record['rows'] = len(df)
+        print("{} data takes up {:.1f} MB as cleaned, {:.1f} MB with " \
+              "compact dtypes".format(label, record['memory_mb_before'], 
+                                      record['memory_mb_after']))
+        error = None
+    except Exception as e:
+        df = None
+        error = e
+    seconds = time.time() - start
+    return label, df, seconds, error
+
+# Most accounts fetched at the same time when source_workers is 0. Each one
+# runs its own requests pool too (see --workers), so dozens of accounts at 
+# once would mostly just wait on the hosts' token buckets.
+MAX_SOURCE_WORKERS = 8
+
+def collect_partner_data(start_date, end_date, source_workers=0, 
+                         accounts=None, fingerprints=None, **options):
+    """
+    Fetches and normalizes the data for start_date..end_date of every 
+    account (every registered connector with .txt key files, by default), 
+    each one through run_source, and returns it all in one frame (None if 
+    every one failed). source_workers accounts run at the same time, in 
+    one pool shared by all of them (0 = all of them, up to 
+    MAX_SOURCE_WORKERS). If fingerprints is a dict, it gets the 
+    day_fingerprints of every account that came back, by account_label,
+    since several accounts can share a Partner in the combined frame.
+    """
+    if accounts is None:
+        accounts = local_accounts()
+    if not accounts:
+        return None
+    
+    load_fetch_dependencies()
+    pool_size = source_workers or min(len(accounts), MAX_SOURCE_WORKERS)
+    with ThreadPoolExecutor(max_workers=pool_size) as executor:
+        results = list(executor.map(in_stage_context(
+            lambda a: run_source(a, start_date, end_date, options)), 
+            accounts))
+    
+    df_container = []
+    for name, df, seconds, error in results:
+        if error is None:
+            print("{} finished in {:.1f} seconds ({} rows)".format(
+                name, seconds, len(df)))
+            df_container.append(df)
+            if fingerprints is not None:
+                fingerprints[name] = day_fingerprints(df)
+        else:
+            print("{} failed after {:.1f} seconds: {!r}".format(
+                name, seconds, error))
+    
+    if not df_container:
+        return None
+    with stage('combine partners') as record:
+        df_concat = concat_facts(df_container)
+        record['rows'] = len(df_concat)
+        record['memory_mb_after'] = round(memory_mb(df_concat), 2)
+    return df_concat
+
+def process_in_batches(start_date, end_date, batch_days, fetch_options, 
+                       store_dir='revenue_store', csv=False, mode='dashboard',
+                       db_path='revenue_warehouse.db', 
+                       drilldown_dir='revenue_drilldown', top_n=10,
+                       fingerprint_path='revenue_fingerprints.json'):
+    """
+    For multi-year backfills. Runs fetch -> clean -> save -> aggregate on 
+    batch_days days at a time, so only one batch's detail rows are ever in
+    memory. They go straight to the Parquet store (the warehouse with 
+    mode='ingest') and, with csv, get appended to 
+    revenue_performance_data.csv. All that's kept of a batch is its rollup
+    cube (a row per Day x Partner x UnitType x App). The fingerprints of 
+    the days written are saved, so later runs know what's in the store.
+    
+    Returns every batch's cube in one frame (None if every batch failed, 
+    or in ingest mode). Batches where every partner failed are listed at 
+    the end, so just those can be run again.
+    """
+    import pandas as pd
+    date_list = date_strings(start_date, end_date)
+    batches = [date_list[num:num+batch_days] 
+               for num in range(0, len(date_list), batch_days)]
+    
+    csv_path = 'revenue_performance_data.csv'
+    if csv and os.path.exists(csv_path):
+        os.remove(csv_path)
+    
+    cube_container = []
+    failed = []
+    saved = read_fingerprints(fingerprint_path)
+    for num, batch in enumerate(batches):
+        print("Batch {} of {}: {} to {}".format(num + 1, len(batches), 
+                                                batch[0], batch[-1]))
+        fingerprints = {}
+        df = collect_partner_data(batch[0], batch[-1], 
+                                  fingerprints=fingerprints, **fetch_options)
+        if df is None:
+            failed.append((batch[0], batch[-1]))
+            continue
+        
+        if mode == 'ingest':
+            with stage('warehouse ingest') as record:
+                ingest_to_warehouse(df, db_path, accounts=list(fingerprints))
+                record['rows'] = len(df)
+            continue
+        
+        with stage('fact store'):
+            # The written days with the failed partners' saved rows kept,
+            # so the drilldown and the cube get whole days
+            df_days = write_fact_store(df, store_dir, 
+                                       accounts=list(fingerprints))
+        with stage('drilldown store'):
+            write_drilldown(df_days, drilldown_dir, top_n)
+        if csv:
+            with stage('data csv'):
+                df.to_csv(csv_path, mode='a', index=False, 
+                          header=not os.path.exists(csv_path))
+        with stage('rollup cube') as record:
+            cube_container.append(build_rollup_cube(df_days))
+            record['rows'] = len(cube_container[-1])
+        with stage('fingerprints'):
+            save_fingerprints(saved, fingerprints, 
+                              sorted(set(df['Day'].dt.strftime('%Y-%m-%d'))),
+                              fingerprint_path)
+    
+    for first_day, last_day in failed:
+        print("Every partner failed for {} to {}".format(first_day, last_day))
+    
+    if not cube_container:
+        return None
+    # The batches don't share days, so their cubes just stack
+    return pd.concat(cube_container, axis=0, ignore_index=True)
+
+def revenue_performance_dashboard(start_date, end_date, workers=4, timeout=60,
+                                  retries=3, source_workers=0, cache_dir=None,
+                                  refetch_days=3, cache_max_age=None, 
+                                  cache_max_mb=None, 
+                                  store_dir='revenue_store', csv=False,
+                                  stream=False, chunk_days=7, 
+                                  checkpoint_dir='fyber_checkpoints',
+                                  cube_path='revenue_cube.parquet', 
+                                  from_cube=False, mode='dashboard', 
+                                  db_path='revenue_warehouse.db', 
+                                  max_points=400, port=5006, 
+                                  refresh_minutes=60, allow_origin=None,
+                                  batch_days=0, 
+                                  variants=('all', 'app', 'partner', 'country'),
+                                  countries=None, dashboard_dir='dashboards',
+                                  render_workers=0, 
+                                  drilldown_dir='revenue_drilldown',
+                                  top_n=10, country=None, ad_unit=None, 
+                                  partner=None, 
+                                  fingerprint_path='revenue_fingerprints.json',
+                                  full_refresh=False, accounts=None, 
+                                  open_browser=True):
+    fetch_options = dict(workers=workers, timeout=timeout, retries=retries, 
+                         source_workers=source_workers, cache_dir=cache_dir, 
+                         refetch_days=refetch_days, stream=stream, 
+                         chunk_days=chunk_days, checkpoint_dir=checkpoint_dir)
+    
+    if mode == 'serve':
+        if accounts is not None:
+            fetch_options['accounts'] = read_accounts(accounts)
+        serve_dashboard(start_date, end_date, fetch_options, 
+                        cube_path=cube_path, port=port, 
+                        refresh_minutes=refresh_minutes, 
+                        max_points=max_points, allow_origin=allow_origin)
+        return
+    
+    if mode == 'render':
+        # The warehouse does the aggregating, so no API calls. Connecting 
+        # would make an empty one, so a wrong --db_path is caught first.
+        if not os.path.exists(db_path):
+            print("There's no warehouse at {}. Run with -m ingest " \
+                  "first.".format(db_path))
+            return
+        with stage('warehouse cube') as record:
+            cube = warehouse_cube(db_path, start_date, end_date)
+            record['rows'] = len(cube)
+        if cube.empty:
+            print("Nothing in {} for {} to {}. Run with -m ingest for those " \
+                  "days first.".format(db_path, start_date, end_date))
+            return
+        bokeh_dashboard_creator(cube, csv=csv, max_points=max_points,
+                                open_browser=open_browser)
+        print("Your dashboard is done!")
+        return
+    
+    if mode == 'batch_render':
+        batch_render_dashboards(start_date, end_date, store_dir=store_dir, 
+                                kinds=variants, countries=countries,
+                                dashboard_dir=dashboard_dir, 
+                                max_points=max_points, 
+                                render_workers=render_workers)
+        return
+    
+    if mode == 'drilldown':
+        drilldown_dashboard(start_date, end_date, 
+                            drilldown_dir=drilldown_dir, top_n=top_n, 
+                            csv=csv, open_browser=open_browser, 
+                            country=country, ad_unit=ad_unit, partner=partner)
+        return
+    
+    if from_cube:
+        # Everything the charts need is in the cube, so no API calls
+        if not os.path.exists(cube_path):
+            print("There's no cube at {}. Run the dashboard without " \
+                  "--from_cube first.".format(cube_path))
+            return
+        with stage('read cube') as record:
+            cube = read_cube(cube_path, start_date, end_date)
+            record['rows'] = len(cube)
+        if cube.empty:
+            print("Nothing in {} for {} to {}. Run the dashboard without " \
+                  "--from_cube for those days first.".format(
+                      cube_path, start_date, end_date))
+            return
+        bokeh_dashboard_creator(cube, csv=csv, max_points=max_points,
+                                open_browser=open_browser)
+        print("Your dashboard is done!")
+        return
+    
+    # The keys are read once, here, and shared by every fetch of the run
+    if accounts is not None:
+        fetch_options['accounts'] = read_accounts(accounts)
+    else:
+        fetch_options['accounts'] = local_accounts()
+    if fetch_options['accounts']:
         now = datetime.datetime.now()
         now_string = now.strftime('%Y-%m-%d')
         
         if end_date != now_string:
             ## End date can't be "today" -- else it won't work--MoPub doesn't do same-day reporting.
-            mopub_df = fetch_mopub_report(start_date, end_date, 
-                                          mopub_inventory_report_id, 
-                                          mopub_api_key)
-            
-            mopub_df = mopub_dataframe_cleaner(mopub_df)
+            if batch_days:
+                cube = process_in_batches(start_date, end_date, batch_days,
+                                          fetch_options, store_dir=store_dir,
+                                          csv=csv, mode=mode, db_path=db_path,
+                                          drilldown_dir=drilldown_dir, 
+                                          top_n=top_n, 
+                                          fingerprint_path=fingerprint_path)
+                if cache_dir is not None:
+                    evict_cache(cache_dir, max_age=cache_max_age, 
+                                max_mb=cache_max_mb)
+                if mode == 'ingest':
+                    print("Your data is in the warehouse!")
+                    return
+                if cube is None:
+                    print("Every partner failed, so there's nothing to chart.")
+                    return
+                with stage('write cube'):
+                    write_cube(cube, cube_path)
+                bokeh_dashboard_creator(cube, csv=csv, max_points=max_points,
+                                        open_browser=open_browser)
+                print("Your data / dashboard is done!")
+                return
             
-            fyber_video_df = fetch_fyber_video_report(start_date, end_date, 
-                                                      fyber_video_username, 
-                                                      fyber_video_password)
+            fingerprints = {}
+            df_concat = collect_partner_data(start_date, end_date, 
+                                             fingerprints=fingerprints,
+                                             **fetch_options)
             
-            fyber_video_df = fyber_video_dataframe_cleaner(fyber_video_df)
+            if cache_dir is not None:
+                evict_cache(cache_dir, max_age=cache_max_age, 
+                            max_mb=cache_max_mb)
             
-            fyber_display_df = fetch_fiber_display_report(start_date, end_date,
-                                                          fyber_display_publisher_id,
-                                                          fyber_display_consumer_key, 
-                                                          fyber_display_consumer_secret)
+            if df_concat is None:
+                print("Every partner failed, so there's nothing to chart.")
+                return
             
-            fyber_display_df = fyber_display_dataframe_cleaner(fyber_display_df)
             print("Data is collected / cleaned!")
-            df_concat = pd.concat([mopub_df, fyber_video_df, fyber_display_df], axis=0)
-            df_concat.to_csv('revenue_performance_data.csv', index=False)
-            bokeh_dashboard_creator(df_concat)
+            
+            if mode == 'ingest':
+                with stage('warehouse ingest') as record:
+                    ingest_to_warehouse(df_concat, db_path, 
+                                        accounts=list(fingerprints))
+                    record['rows'] = len(df_concat)
+                print("Your data is in the warehouse!")
+                return
+            
+            # SSPs restate recent days, but most of a long range comes back 
+            # the same as last run. Only new / restated days get written 
+            # and re-aggregated, the rest of the cube is already right.
+            with stage('fingerprints') as record:
+                saved = read_fingerprints(fingerprint_path)
+                if full_refresh or not os.path.exists(cube_path):
+                    saved = {}
+                changed = restated_days(fingerprints, saved)
+                df_changed = df_concat[df_concat['Day'].dt.strftime(
+                    '%Y-%m-%d').isin(changed)]
+                record['rows'] = len(df_changed)
+            
+            if len(df_changed):
+                with stage('fact store'):
+                    # The written days with the failed partners' saved rows
+                    # kept, so the drilldown and the cube get whole days
+                    df_changed = write_fact_store(df_changed, store_dir, 
+                                                  accounts=list(fingerprints))
+                with stage('drilldown store'):
+                    write_drilldown(df_changed, drilldown_dir, top_n)
+                with stage('rollup cube') as record:
+                    cube = build_rollup_cube(df_changed)
+                    record['rows'] = len(cube)
+                with stage('write cube'):
+                    write_cube(cube, cube_path)
+                save_fingerprints(saved, fingerprints, changed, 
+                                  fingerprint_path)
+            if csv:
+                with stage('data csv'):
+                    df_concat.to_csv('revenue_performance_data.csv', 
+                                     index=False)
+            with stage('read cube') as record:
+                cube = read_cube(cube_path, start_date, end_date)
+                record['rows'] = len(cube)
+            bokeh_dashboard_creator(cube, csv=csv, max_points=max_points,
+                                    open_browser=open_browser)
             print("Your data / dashboard is done!")
     
         else:
             print("End date can't be 'today', MoPub doesn't give same-day data via the API.")
             
     else:
-        print("You need all valid API keys to use this program." \
+        print("You need valid API keys for at least one partner to use " \
+              "this program." \
               " So the program is probably not going to work for you. Sorry!")
 
 if __name__ == '__main__':
-    revenue_performance_dashboard(args.start_date, args.end_date)
\ No newline at end of file
+    args = parse_args()
+    started = time.time()
+    # cProfile only sees this thread, see --profile
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        revenue_performance_dashboard(args.start_date, args.end_date, 
+                                      workers=args.workers, timeout=args.timeout,
+                                      retries=args.retries, 
+                                      source_workers=args.source_workers,
+                                      cache_dir=args.cache_dir, 
+                                      refetch_days=args.refetch_days,
+                                      cache_max_age=args.cache_max_age,
+                                      cache_max_mb=args.cache_max_mb,
+                                      store_dir=args.store_dir, csv=args.csv,
+                                      stream=args.stream, 
+                                      chunk_days=args.chunk_days,
+                                      checkpoint_dir=args.checkpoint_dir,
+                                      cube_path=args.cube_path, 
+                                      from_cube=args.from_cube, mode=args.mode,
+                                      db_path=args.db_path, 
+                                      max_points=args.max_points, port=args.port,
+                                      refresh_minutes=args.refresh_minutes,
+                                      allow_origin=args.allow_origin,
+                                      batch_days=args.batch_days,
+                                      variants=args.variants,
+                                      countries=args.countries,
+                                      dashboard_dir=args.dashboard_dir,
+                                      render_workers=args.render_workers,
+                                      drilldown_dir=args.drilldown_dir,
+                                      top_n=args.top_n, country=args.country,
+                                      ad_unit=args.ad_unit, 
+                                      partner=args.partner,
+                                      fingerprint_path=args.fingerprint_path,
+                                      full_refresh=args.full_refresh,
+                                      accounts=args.accounts,
+                                      open_browser=not args.no_browser)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print("cProfile stats written to {}".format(args.profile))
+        print_stage_summary()
+        print_host_metrics()
+        if args.report is not None:
+            write_run_report(args.report, started, vars(args))
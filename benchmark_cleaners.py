@@ -0,0 +1,199 @@
+"""
+Benchmarks the Fyber Video / Fyber Display cleaners against the row-by-row
+versions they replaced, on made-up payloads of 10k, 100k and 1M rows, and
+checks that both versions give back exactly the same DataFrame.
+
+    python benchmark_cleaners.py
+    python benchmark_cleaners.py --sizes 10000 100000 --repeat 3
+"""
+import argparse
+import contextlib
+import functools
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from RevenuePerformanceDashboard import (FYBER_DISPLAY_APP_NAMES,
+                                         FYBER_VIDEO_APP_NAMES,
+                                         fyber_video_dataframe_cleaner,
+                                         fyber_display_dataframe_cleaner)
+
+VIDEO_APPS = ["IMVU iOS Primary Wall", "IMVU iOS External Offer Wall",
+              "IMVU Google Play", "Blue Bar Bundle ", "NEXT Featured Offers"]
+
+COUNTRIES = ['US', 'GB', 'DE', 'FR', 'BR', 'CA', 'AU', 'JP', 'MX', 'IN']
+
+def fyber_video_payload(rows, seed=0):
+    """A fake publisher-kpis.json 'data' payload, already in a DataFrame"""
+    rng = np.random.RandomState(seed)
+    days = pd.date_range('2019-01-01', periods=365).strftime('%Y-%m-%d')
+    impressions = rng.randint(0, 5000, rows).astype(float)
+    # Fyber leaves some counts empty, which the cleaner fills with 0
+    impressions[rng.rand(rows) < 0.05] = np.nan
+
+    return pd.DataFrame({
+        'date': np.asarray(days)[rng.randint(0, len(days), rows)],
+        'application_id': rng.randint(1000, 1005, rows),
+        'application_name': np.asarray(VIDEO_APPS)[rng.randint(0, len(VIDEO_APPS), rows)],
+        'ad_format': 'rewarded',
+        'country': np.asarray(COUNTRIES)[rng.randint(0, len(COUNTRIES), rows)],
+        'requests': rng.randint(0, 50000, rows).astype(float),
+        'impressions': impressions,
+        'completions': rng.randint(0, 5000, rows),
+        'ecpm_eur': rng.rand(rows) * 20,
+        'ecpm_usd': rng.rand(rows) * 22,
+        'fills': rng.randint(0, 5000, rows),
+        'revenue_eur': rng.rand(rows) * 100,
+        'revenue_usd': rng.rand(rows) * 110,
+        'unique_impressions': rng.randint(0, 5000, rows),
+    })
+
+def fyber_display_payload(rows, seed=0):
+    """A fake inner-active performance payload, already in a DataFrame"""
+    rng = np.random.RandomState(seed)
+    day_seconds = pd.date_range('2019-01-01', periods=365).astype('int64') // 10**9
+
+    return pd.DataFrame({
+        'contentCategories': [[]] * rows,
+        'contentId': rng.randint(1, 100, rows),
+        'contentName': 'IMVU',
+        'publisherId': 1234,
+        'distributorName': 'IMVU',
+        'ecpm': rng.rand(rows) * 5,
+        'ctr': rng.rand(rows),
+        'fillRate': rng.rand(rows),
+        'adRequests': rng.randint(0, 50000, rows),
+        'applicationName': np.asarray(['IMVU_iOS_Banner', 'IMVU_iOS_MREC'])[rng.randint(0, 2, rows)],
+        'clicks': rng.randint(0, 100, rows),
+        'country': np.asarray(COUNTRIES)[rng.randint(0, len(COUNTRIES), rows)],
+        'date': np.asarray(day_seconds)[rng.randint(0, len(day_seconds), rows)],
+        'revenue': rng.rand(rows) * 10,
+        'impressions': rng.randint(0, 5000, rows),
+    })
+
+# The cleaners as they were before they were vectorized, kept here so the
+# new ones can be checked / timed against them.
+
+def fyber_video_dataframe_cleaner_loop(dataframe):
+    df = dataframe
+    df = df.fillna(0)
+
+    delete_list = ['application_id', 'completions', 'ecpm_eur', 'ecpm_usd',
+                   'fills', 'revenue_eur', 'unique_impressions']
+
+    for entry in delete_list:
+        del df[entry]
+
+    df['Ad Type'] = 'video'
+    df['Partner'] = 'Fyber_Video'
+    df['Total_Code_Served'] = 0
+    df['Clicks'] = 0
+
+    df = df.rename(columns={'date':'Day', 'application_name':'App',
+                            "ad_format":"AdUnit",  "Ad Type":"UnitType",
+                            "country":"Country", "requests":"Requests",
+                            "impressions":"Impressions", "clicks":"Clicks",
+                            "revenue_usd":"Revenue"})
+
+    df['App'] = df['App'].replace({"IMVU iOS Primary Wall":"IMVU iOS",
+                                   "IMVU iOS External Offer Wall":"IMVU iOS",
+                                   "IMVU Google Play":"IMVU Android"})
+
+    df['Impressions'] = df['Impressions'].apply(lambda x:int(x))
+    df['Requests'] = df['Requests'].apply(lambda x:int(x))
+
+    df = df[["Day", "App", "AdUnit", "UnitType", "Country",
+             "Total_Code_Served", "Requests", "Impressions",
+             "Clicks", "Revenue", "Partner"]]
+
+    drop_index_list = []
+    for num in list(df.index):
+        if df.loc[num, 'App'] == 'Blue Bar Bundle ' or df.loc[num, 'App'] == 'NEXT Featured Offers':
+            drop_index_list.append(num)
+
+    df = df.drop(drop_index_list, axis=0)
+
+    return df
+
+def fyber_display_dataframe_cleaner_loop(dataframe):
+    df = dataframe
+
+    delete_list = ['contentCategories', 'contentId', 'contentName', 'publisherId',
+                   'distributorName', 'ecpm', 'ctr', 'fillRate']
+
+    for entry in delete_list:
+        del df[entry]
+
+    df['App'] = 'IMVU iOS'
+    df['Partner'] = 'Fyber'
+    df['Total_Code_Served'] = 0
+    df['UnitType'] = 'banner'
+
+    df = df.rename(columns={'adRequests':'Requests', 'applicationName':'AdUnit',
+                            "clicks":"Clicks", "country":"Country", 'date':'Day',
+                            "revenue":"Revenue", "impressions":"Impressions"})
+
+    df = df[['Day', 'App', 'AdUnit', 'UnitType', 'Country', 'Total_Code_Served',
+           'Requests', 'Impressions', 'Clicks', 'Revenue', 'Partner']]
+
+    df['Day'] = pd.to_datetime(df['Day'], unit='s')
+    df['Day'] = df['Day'].apply(lambda x: x.date())
+
+    return df
+
+def best_time(cleaner, payload, repeat):
+    """Fastest of `repeat` runs, in seconds, plus the cleaner's output"""
+    times = []
+    for num in range(repeat):
+        df = payload.copy()
+        # the cleaners print a status line, which would flood the table
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = cleaner(df)
+            times.append(time.perf_counter() - start)
+    return min(times), result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Fyber ' \
+                                     'cleaners against the row-by-row versions')
+    parser.add_argument('--sizes', type=int, nargs='+', metavar='',
+                        default=[10000, 100000, 1000000],
+                        help="Payload sizes (rows) to run")
+    parser.add_argument('--repeat', type=int, metavar='', default=1,
+                        help="Runs per cleaner / size, the fastest one counts")
+    args = parser.parse_args()
+
+    benchmarks = [
+        # the loop versions had the local account's app names built in
+        ('Fyber Video', fyber_video_payload, fyber_video_dataframe_cleaner_loop,
+         functools.partial(fyber_video_dataframe_cleaner,
+                           app_names=FYBER_VIDEO_APP_NAMES)),
+        ('Fyber Display', fyber_display_payload,
+         fyber_display_dataframe_cleaner_loop,
+         functools.partial(fyber_display_dataframe_cleaner,
+                           app_names=FYBER_DISPLAY_APP_NAMES)),
+    ]
+
+    print("{:<14}{:>10}{:>12}{:>12}{:>10}  {}".format(
+        'Cleaner', 'Rows', 'Loop (s)', 'Vector (s)', 'Speedup', 'Output'))
+
+    for name, payload_maker, old_cleaner, new_cleaner in benchmarks:
+        for rows in args.sizes:
+            payload = payload_maker(rows)
+            old_seconds, old_df = best_time(old_cleaner, payload, args.repeat)
+            new_seconds, new_df = best_time(new_cleaner, payload, args.repeat)
+
+            try:
+                pd.testing.assert_frame_equal(old_df, new_df)
+                same = 'identical'
+            except AssertionError as e:
+                same = 'DIFFERENT: {}'.format(str(e).splitlines()[0])
+
+            print("{:<14}{:>10,}{:>12.3f}{:>12.3f}{:>9.1f}x  {}".format(
+                name, rows, old_seconds, new_seconds,
+                old_seconds / new_seconds, same))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+"""
+Benchmarks the whole pipeline, fetch -> clean -> store -> cube ->
+bokeh_dashboard_creator, without real API keys. It generates MoPub per-day
+CSVs, Fyber Video publisher-kpis.json and inner-active performance JSON at
+the scale you ask for (days x apps x countries x ad units), serves them from
+a local stand-in HTTP server (in its own process, with a delay on every
+request to act like the real APIs), and points the dashboard at it.
+
+The time of every stage (see stage() in RevenuePerformanceDashboard.py) is
+saved to benchmark_results/<commit>-<scale>.json, so a run on one commit
+can be compared with a run on another:
+
+    python benchmark_pipeline.py --days 90 --countries 50
+    git checkout other-branch
+    python benchmark_pipeline.py --days 90 --countries 50 \\
+        --compare benchmark_results/1a2b3c4-90d-2a-50c-3u.json
+
+The fixtures are generated from a fixed seed, so the same scale always
+serves the same data.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import RevenuePerformanceDashboard as dashboard
+
+MOPUB_APPS = ["IMVU iOS - #1 3D Avatar Social App",
+              "IMVU Android - #1 3D Avatar Social App"]
+
+MOPUB_FORMATS = ['Banner', 'Native', 'Rewarded video']
+
+VIDEO_APPS = ["IMVU iOS Primary Wall", "IMVU iOS External Offer Wall",
+              "IMVU Google Play", "Blue Bar Bundle ", "NEXT Featured Offers"]
+
+VIDEO_FORMATS = ['rewarded', 'interstitial', 'offerwall']
+
+def fixture_days(start_date, days):
+    """days dates from start_date on, as datetime.dates"""
+    first = datetime.date.fromisoformat(start_date)
+    return [first + datetime.timedelta(days=num) for num in range(days)]
+
+def country_codes(countries):
+    """countries made up two letter country codes (US, GB... then AA, AB...)"""
+    codes = ['US', 'GB', 'DE', 'FR', 'BR', 'CA', 'AU', 'JP', 'MX', 'IN']
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    codes += [a + b for a in letters for b in letters if a + b not in codes]
+    return codes[:countries]
+
+def make_fixtures(start_date, days, apps, countries, ad_units, seed=0):
+    """
+    Generates every day's payload for the three SSPs, already encoded so the
+    server only has to join them:
+
+    mopub:         {'YYYY-MM-DD': csv bytes}
+    fyber_video:   {'YYYY-MM-DD': the day's records as JSON, without the []}
+    fyber_display: {unix midnight (UTC): the day's records, same}
+
+    Each partner gets apps x countries x ad_units rows a day. The apps cycle
+    through the names the cleaners know, so the rows all make it into the
+    charts (Fyber Video's Blue Bar / NEXT apps are dropped by its cleaner,
+    same as in the real data).
+    """
+    codes = country_codes(countries)
+    fixtures = {'mopub': {}, 'fyber_video': {}, 'fyber_display': {}}
+
+    for day in fixture_days(start_date, days):
+        rng = random.Random('{}-{}'.format(seed, day))
+
+        lines = ['Day,App,App ID,AdUnit,AdUnit ID,AdUnit Format,Country,' \
+                 'Requests,Impressions,Clicks,Revenue']
+        for app in range(apps):
+            app_name = MOPUB_APPS[app % len(MOPUB_APPS)]
+            for unit in range(ad_units):
+                unit_format = MOPUB_FORMATS[unit % len(MOPUB_FORMATS)]
+                for country in codes:
+                    requests = rng.randint(1000, 90000)
+                    lines.append('{},{},app{},{} {} {},unit{}-{},{},{},{},{},' \
+                                 '{},{:.4f}'.format(
+                                     day, app_name, app, app_name[:9],
+                                     unit_format, unit, app, unit, unit_format,
+                                     country, requests,
+                                     rng.randint(0, requests),
+                                     rng.randint(0, 500), rng.random() * 100))
+        fixtures['mopub'][str(day)] = ('\n'.join(lines) + '\n').encode()
+
+        records = []
+        for app in range(apps):
+            app_name = VIDEO_APPS[app % len(VIDEO_APPS)]
+            for unit in range(ad_units):
+                for country in codes:
+                    requests = rng.randint(100, 9000)
+                    # Fyber leaves some counts empty
+                    impressions = (None if rng.random() < 0.05
+                                   else float(rng.randint(0, requests)))
+                    records.append({
+                        'date': str(day), 'application_id': app,
+                        'application_name': app_name,
+                        'ad_format': VIDEO_FORMATS[unit % len(VIDEO_FORMATS)],
+                        'country': country, 'requests': float(requests),
+                        'impressions': impressions,
+                        'completions': rng.randint(0, 900),
+                        'ecpm_eur': rng.random() * 20,
+                        'ecpm_usd': rng.random() * 22,
+                        'fills': rng.randint(0, 900),
+                        'revenue_eur': rng.random() * 50,
+                        'revenue_usd': rng.random() * 55,
+                        'unique_impressions': rng.randint(0, 900)})
+        fixtures['fyber_video'][str(day)] = json.dumps(records)[1:-1]
+
+        midnight = int(datetime.datetime(day.year, day.month, day.day,
+                       tzinfo=datetime.timezone.utc).timestamp())
+        records = []
+        for app in range(apps):
+            for unit in range(ad_units):
+                for country in codes:
+                    requests = rng.randint(100, 90000)
+                    records.append({
+                        'contentCategories': [], 'contentId': app,
+                        'contentName': 'IMVU', 'publisherId': 1,
+                        'distributorName': 'IMVU', 'ecpm': rng.random() * 5,
+                        'ctr': rng.random(), 'fillRate': rng.random(),
+                        'adRequests': requests,
+                        'applicationName': 'IMVU_iOS_{}'.format(
+                            ['Banner', 'MREC'][unit % 2] +
+                            ('' if unit < 2 else str(unit))),
+                        'clicks': rng.randint(0, 100), 'country': country,
+                        'date': midnight, 'revenue': rng.random() * 10,
+                        'impressions': rng.randint(0, requests)})
+        fixtures['fyber_display'][midnight] = json.dumps(records)[1:-1]
+
+    return fixtures
+
+def fixture_handler(fixtures, latency):
+    """
+    A request handler class that answers the three SSPs' report urls out of
+    fixtures, latency seconds after each request comes in.
+    """
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+
+            if url.path.endswith('/download_report'):
+                body = fixtures['mopub'].get(query['date'][0])
+                content_type = 'text/csv'
+                if body is None:
+                    self.send_error(404)
+                    return
+            elif url.path.endswith('/publisher-kpis.json'):
+                since, until = query['since'][0], query['until'][0]
+                days = [records for day, records in
+                        sorted(fixtures['fyber_video'].items())
+                        if since <= day <= until and records]
+                body = ('{"data": [' + ','.join(days) + ']}').encode()
+                content_type = 'application/json'
+            elif '/performance/publisher/' in url.path:
+                start, end = url.path.rstrip('/').split('/')[-2:]
+                days = [records for day, records in
+                        sorted(fixtures['fyber_display'].items())
+                        if float(start) <= day <= float(end) and records]
+                body = ('[' + ','.join(days) + ']').encode()
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FixtureHandler
+
+def run_fixture_server(scale, latency, port_queue):
+    """Generates the fixtures and serves them until the process is killed"""
+    fixtures = make_fixtures(**scale)
+    server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                 fixture_handler(fixtures, latency))
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+@contextlib.contextmanager
+def fixture_server(scale, latency):
+    """
+    Starts run_fixture_server in its own process, so serving doesn't take
+    the GIL from the pipeline being timed, and yields its base url.
+    """
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_fixture_server,
+                                      args=(scale, latency, port_queue),
+                                      daemon=True)
+    process.start()
+    try:
+        port = port_queue.get(timeout=600)
+        yield 'http://127.0.0.1:{}'.format(port)
+    finally:
+        process.terminate()
+        process.join()
+
+def check_pipeline(stages):
+    """
+    Raises RuntimeError if a run didn't do the work being timed: a partner
+    wasn't fetched, a fetch / clean failed or came back without rows, or
+    collect_partner_data had nothing to combine (every partner failed).
+    A run like that is fast for the wrong reason.
+    """
+    problems = []
+    fetches = 0
+    for connector in dashboard.CONNECTORS:
+        names = ['fetch ' + connector.name, 'clean ' + connector.name]
+        records = [r for r in stages if r['stage'] in names]
+        fetches = max(fetches, len([r for r in records
+                                    if r['stage'] == names[0]]))
+        if not records:
+            problems.append('{} was never fetched'.format(connector.name))
+        for record in records:
+            if 'error' in record:
+                problems.append('{} failed: {}'.format(record['stage'],
+                                                       record['error']))
+            elif not record['rows']:
+                problems.append('{} has no rows'.format(record['stage']))
+
+    # collect_partner_data combines once per fetch (per batch, with
+    # --batch_days) unless every partner failed and it returned None
+    combines = len([r for r in stages if r['stage'] == 'combine partners'])
+    if combines < fetches:
+        problems.append('collect_partner_data returned None {} of {} ' \
+                        'times'.format(fetches - combines, fetches))
+
+    if problems:
+        raise RuntimeError('The pipeline run is no good:\n' +
+                           '\n'.join(problems))
+
+def run_pipeline(start_date, end_date, options):
+    """
+    One run of revenue_performance_dashboard in a fresh temporary folder, so
+    nothing (store, cube, checkpoints) is left over from the run before.
+    Returns the stage records and the total seconds. Raises RuntimeError
+    (with the end of what the pipeline printed) if check_pipeline finds
+    it didn't do its work.
+    """
+    del dashboard.RUN_STAGES[:]
+    for key in dashboard.RUN_STATS:
+        dashboard.RUN_STATS[key] = 0
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            for name in [name for connector in dashboard.CONNECTORS
+                         for name in connector.credentials]:
+                with open(name + '.txt', 'w') as f:
+                    f.write('benchmark-' + name)
+            # the pipeline prints a status line per download / stage
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                start = time.perf_counter()
+                dashboard.revenue_performance_dashboard(start_date, end_date,
+                                                        **options)
+                seconds = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+
+    stages = list(dashboard.RUN_STAGES)
+    try:
+        check_pipeline(stages)
+    except RuntimeError as e:
+        raise RuntimeError('{}\n\nIt printed:\n{}'.format(
+            e, output.getvalue()[-2000:])) from None
+    return stages, seconds
+
+def git_commit():
+    """The short hash of the checked out commit ('unknown' outside git)"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def print_comparison(result, baseline):
+    """Prints result's stage times next to baseline's"""
+    print("\nCompared with {} ({}):".format(baseline['commit'],
+                                           baseline['created']))
+    print("{:<24}{:>10}{:>10}{:>9}".format('Stage', 'Before', 'After',
+                                          'Change'))
+    before = {s['stage']: s['seconds'] for s in baseline['stages']}
+    before['total'] = baseline['seconds']
+    after = [(s['stage'], s['seconds']) for s in result['stages']]
+    after.append(('total', result['seconds']))
+    for name, seconds in after:
+        if name in before and before[name]:
+            print("{:<24}{:>10.3f}{:>10.3f}{:>+8.0f}%".format(
+                name[:23], before[name], seconds,
+                100 * (seconds / before[name] - 1)))
+        else:
+            print("{:<24}{:>10}{:>10.3f}{:>9}".format(name[:23], '-',
+                                                      seconds, 'new'))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard ' \
+                                     'end to end against a local stand-in ' \
+                                     'for the SSP APIs')
+    parser.add_argument('--days', type=int, metavar='', default=30,
+                        help="Days of data to generate / fetch")
+    parser.add_argument('--apps', type=int, metavar='', default=2,
+                        help="Apps per partner")
+    parser.add_argument('--countries', type=int, metavar='', default=20,
+                        help="Countries per app")
+    parser.add_argument('--ad_units', type=int, metavar='', default=3,
+                        help="Ad units per app")
+    parser.add_argument('--start_date', type=str, metavar='',
+                        default='2019-01-01',
+                        help="First day of the generated data")
+    parser.add_argument('--latency', type=float, metavar='', default=0.05,
+                        help="Seconds the stand-in server waits before " \
+                        "answering each request")
+    parser.add_argument('--repeat', type=int, metavar='', default=3,
+                        help="Runs of the pipeline, the fastest time of " \
+                        "each stage counts")
+    parser.add_argument('-w', '--workers', type=int, metavar='', default=4)
+    parser.add_argument('--source_workers', type=int, metavar='', default=0)
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--chunk_days', type=int, metavar='', default=7)
+    parser.add_argument('--batch_days', type=int, metavar='', default=0)
+    parser.add_argument('--csv', action='store_true')
+    parser.add_argument('--results_dir', type=str, metavar='',
+                        default='benchmark_results',
+                        help="Folder the results json is saved to")
+    parser.add_argument('--compare', type=str, metavar='', default=None,
+                        help="A results json from an earlier run to " \
+                        "compare this one with")
+    args = parser.parse_args()
+
+    scale = dict(start_date=args.start_date, days=args.days, apps=args.apps,
+                 countries=args.countries, ad_units=args.ad_units)
+    options = dict(workers=args.workers, source_workers=args.source_workers,
+                   stream=args.stream, chunk_days=args.chunk_days,
+                   batch_days=args.batch_days, csv=args.csv,
+                   open_browser=False)
+    end_date = fixture_days(args.start_date, args.days)[-1].isoformat()
+
+    with fixture_server(scale, args.latency) as base_url:
+        dashboard.MOPUB_API = base_url
+        dashboard.FYBER_VIDEO_API = base_url
+        dashboard.FYBER_DISPLAY_API = base_url
+
+        runs = [run_pipeline(args.start_date, end_date, options)
+                for num in range(args.repeat)]
+
+    # Fastest time of each stage, the rest (rows, bytes...) from the
+    # first run, since they're the same every run
+    stages = runs[0][0]
+    for record in stages:
+        record['seconds'] = min(s['seconds'] for run_stages, seconds in runs
+                                for s in run_stages
+                                if s['stage'] == record['stage'])
+
+    result = {
+        'commit': git_commit(),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'scale': scale,
+        'latency': args.latency,
+        'options': options,
+        'repeat': args.repeat,
+        'seconds': round(min(seconds for run_stages, seconds in runs), 3),
+        'stages': stages,
+    }
+
+    print("{} days x {} apps x {} countries x {} ad units, {} s latency, " \
+          "best of {}".format(args.days, args.apps, args.countries,
+                              args.ad_units, args.latency, args.repeat))
+    dashboard.RUN_STAGES[:] = stages
+    dashboard.print_stage_summary()
+    print("{:<24}{:>9.2f}".format('total', result['seconds']))
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    results_path = os.path.join(args.results_dir, '{}-{}d-{}a-{}c-{}u.json'.format(
+        result['commit'], args.days, args.apps, args.countries, args.ad_units))
+    with open(results_path, 'w') as f:
+        json.dump(result, f, indent=2)
+    print("Results saved to {}".format(results_path))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            print_comparison(result, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Times how long RevenuePerformanceDashboard.py takes to start doing useful
+work on its short command line paths, each one in a fresh interpreter:
+
+    import       import RevenuePerformanceDashboard (as a library)
+    help         --help
+    bad date     a start date that doesn't exist (exits with an error)
+    fetch only   -m ingest of one day, from the benchmark_pipeline.py
+                 stand-in server, into a SQLite warehouse
+    render only  -m render of that day from the warehouse
+
+It also lists which heavy packages (pandas, bokeh, requests...) each path
+ended up importing, from python -X importtime. The results are saved to
+benchmark_results/startup-<commit>.json so commits can be compared:
+
+    python benchmark_startup.py
+    python benchmark_startup.py --compare benchmark_results/startup-1a2b3c4.json
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark_pipeline import fixture_server, git_commit
+from RevenuePerformanceDashboard import CONNECTORS
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'RevenuePerformanceDashboard.py')
+
+HEAVY_PACKAGES = ['pandas', 'numpy', 'pyarrow', 'bokeh', 'requests',
+                  'requests_oauthlib']
+
+def warehouse_rows(path):
+    """Rows in the warehouse the fetch only path ingested into"""
+    with sqlite3.connect(path) as conn:
+        return conn.execute('SELECT COUNT(*) FROM revenue').fetchone()[0]
+
+def startup_paths(day):
+    """
+    (name, command line arguments, expected exit code, output file, check)
+    of every path that gets timed. A path with an output file has to 
+    write it (and check(path), if given, has to come back truthy), since 
+    a run where every partner failed still exits with 0.
+    """
+    return [
+        ('import', ['-c', 'import RevenuePerformanceDashboard'], 0, None, 
+         None),
+        ('help', [SCRIPT, '--help'], 0, None, None),
+        ('bad date', [SCRIPT, '-s', '2019-13-01', '-e', day], 2, None, None),
+        ('fetch only', [SCRIPT, '-s', day, '-e', day, '-m', 'ingest',
+                        '--chunk_days', '0'], 0, 'revenue_warehouse.db', 
+         warehouse_rows),
+        ('render only', [SCRIPT, '-s', day, '-e', day, '-m', 'render',
+                         '--no_browser'], 0, 'dashboard.html', None),
+    ]
+
+def run_path(arguments, env, work_dir, returncode=0, output_file=None, 
+             check=None):
+    """
+    Runs python with arguments once and returns the wall time. Raises 
+    RuntimeError, with the end of the run's output, if it exits with 
+    anything but returncode or doesn't write a good output_file, so a 
+    broken run is never reported as a fast one.
+    """
+    path = None
+    if output_file is not None:
+        # so only what this run wrote counts (render only reads the 
+        # warehouse the last fetch only run left behind)
+        path = os.path.join(work_dir, output_file)
+        if os.path.exists(path):
+            os.remove(path)
+    
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable] + arguments, cwd=work_dir, 
+                            env=env, stdout=subprocess.PIPE, 
+                            stderr=subprocess.STDOUT)
+    seconds = time.perf_counter() - start
+    
+    output = result.stdout.decode(errors='replace')
+    if result.returncode != returncode:
+        raise RuntimeError("{} exited with {} (expected {}):\n{}".format(
+            ' '.join(arguments), result.returncode, returncode, 
+            output[-2000:]))
+    if path is not None and (not os.path.exists(path) or 
+                             (check is not None and not check(path))):
+        raise RuntimeError("{} didn't write {}:\n{}".format(
+            ' '.join(arguments), output_file, output[-2000:]))
+    return seconds
+
+def heavy_imports(arguments, env, work_dir):
+    """The HEAVY_PACKAGES a run of python with arguments imports"""
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + arguments,
+                            cwd=work_dir, env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE)
+    imported = set()
+    for line in result.stderr.decode(errors='replace').splitlines():
+        if line.startswith('import time:'):
+            module = line.rsplit('|', 1)[-1].strip()
+            imported.add(module.split('.')[0])
+    return [package for package in HEAVY_PACKAGES if package in imported]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the start up ' \
+                                     'time of the dashboard command line')
+    parser.add_argument('--repeat', type=int, metavar='', default=5,
+                        help="Runs of each path, the fastest and the " \
+                        "median are reported")
+    parser.add_argument('--results_dir', type=str, metavar='',
+                        default='benchmark_results',
+                        help="Folder the results json is saved to")
+    parser.add_argument('--compare', type=str, metavar='', default=None,
+                        help="A results json from an earlier run to " \
+                        "compare this one with")
+    args = parser.parse_args()
+
+    day = '2019-01-01'
+    scale = dict(start_date=day, days=1, apps=2, countries=5, ad_units=3)
+    paths = startup_paths(day)
+    results = []
+
+    with tempfile.TemporaryDirectory() as work_dir, \
+         fixture_server(scale, latency=0) as base_url:
+        for name in [name for connector in CONNECTORS
+                     for name in connector.credentials]:
+            with open(os.path.join(work_dir, name + '.txt'), 'w') as f:
+                f.write('benchmark-' + name)
+
+        env = dict(os.environ, MOPUB_API=base_url, FYBER_VIDEO_API=base_url,
+                   FYBER_DISPLAY_API=base_url,
+                   PYTHONPATH=os.path.dirname(SCRIPT))
+
+        for name, arguments, returncode, output_file, check in paths:
+            times = [run_path(arguments, env, work_dir, returncode, 
+                              output_file, check)
+                     for num in range(args.repeat)]
+            results.append({
+                'path': name,
+                'fastest': round(min(times), 3),
+                'median': round(statistics.median(times), 3),
+                'imports': heavy_imports(arguments, env, work_dir),
+            })
+
+    print("{:<14}{:>10}{:>10}  {}".format('Path', 'Fastest', 'Median',
+                                          'Heavy imports'))
+    for result in results:
+        print("{:<14}{:>10.3f}{:>10.3f}  {}".format(
+            result['path'], result['fastest'], result['median'],
+            ', '.join(result['imports']) or '-'))
+
+    output = {'commit': git_commit(), 'python': sys.version.split()[0],
+              'repeat': args.repeat, 'paths': results}
+    os.makedirs(args.results_dir, exist_ok=True)
+    results_path = os.path.join(args.results_dir,
+                                'startup-{}.json'.format(output['commit']))
+    with open(results_path, 'w') as f:
+        json.dump(output, f, indent=2)
+    print("Results saved to {}".format(results_path))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        before = {r['path']: r['fastest'] for r in baseline['paths']}
+        print("\nCompared with {}:".format(baseline['commit']))
+        for result in results:
+            if result['path'] in before:
+                print("{:<14}{:>10.3f}{:>10.3f}{:>+8.0f}%".format(
+                    result['path'], before[result['path']],
+                    result['fastest'],
+                    100 * (result['fastest'] / before[result['path']] - 1)))
+
+if __name__ == '__main__':
+    main()